@@ -0,0 +1,67 @@
+"""
+Redis-backed cache helpers
+Caching is optional: without REDIS_URL (or if Redis is down) every lookup is a miss
+"""
+import os
+import hashlib
+import logging
+from typing import Any, Optional
+
+import orjson
+import redis
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+_client: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> Optional[aioredis.Redis]:
+    """Shared async Redis client, or None when caching is not configured"""
+    global _client
+    if _client is None:
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            return None
+        # Bound connect as well as reads, so an unreachable Redis is a quick miss
+        _client = aioredis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+    return _client
+
+
+def content_key(prefix: str, version: int, content: str) -> str:
+    """
+    Content-addressed cache key: prefix + version + SHA-256 of the content
+
+    Bump the version when the code producing the cached value changes, so
+    entries written by the old code are no longer read.
+    """
+    return f"{prefix}:v{version}:{hashlib.sha256(content.encode('utf-8')).hexdigest()}"
+
+
+async def cache_get_json(key: str) -> Optional[Any]:
+    """Get a JSON value from the cache (None on miss or error)"""
+    client = get_redis()
+    if client is None:
+        return None
+
+    try:
+        raw = await client.get(key)
+    except redis.RedisError as e:
+        logger.warning("Cache read failed for %s: %s", key, e)
+        return None
+
+    return orjson.loads(raw) if raw is not None else None
+
+
+async def cache_set_json(key: str, value: Any, ttl: int = DEFAULT_TTL_SECONDS):
+    """Store a JSON value in the cache (errors are logged and ignored)"""
+    client = get_redis()
+    if client is None:
+        return
+
+    try:
+        await client.setex(key, ttl, orjson.dumps(value))
+    except redis.RedisError as e:
+        logger.warning("Cache write failed for %s: %s", key, e)
@@ -2,22 +2,261 @@
 AI-Powered Concept Extraction and Question Generation
 Uses OpenAI API to extract testable concepts and generate multi-mode questions
 """
-import openai
 import os
-import json
-from typing import Dict, List
+import asyncio
+import io
+import logging
+import orjson
+import re
+import sys
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
 import uuid
+import httpx
+import tiktoken
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError, InternalServerError, RateLimitError
+from tenacity import before_sleep_log, retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 
 from models import Concept, Question
+from cache import content_key, cache_get_json, cache_set_json
+
+logger = logging.getLogger(__name__)
+
+_openai_client: Optional[AsyncOpenAI] = None
+
+# Part of every cache key; bump when extraction or prompt changes alter the
+# cached output, so stale entries from the previous version aren't served
+CACHE_VERSION = 2
+
+# Concept columns stored in the extraction cache (ids/material are per-upload)
+CACHED_CONCEPT_FIELDS = (
+    'name', 'type', 'full_name', 'definition', 'context', 'complexity', 'domain',
+    'formulas', 'examples', 'related_concepts', 'dependencies'
+)
+
+# "Term is/refers to/means/: definition." for text-based extraction, as one alternation
+# so the text is scanned once instead of once per connective
+DEFINITION_RE = re.compile(
+    r'([A-Z][a-zA-Z\s]{2,30})(?:\s+(?:is|refers to|means)\s+|:\s+)([^.]{20,200})\.'
+)
+
+# Period-delimited sentences, scanned in C instead of splitting and filtering in Python:
+# SENTENCE_RE matches the non-blank ones, LONG_SENTENCE_RE only those long enough to
+# possibly be over 40 chars once stripped
+SENTENCE_RE = re.compile(r'[^.]*[^.\s][^.]*')
+LONG_SENTENCE_RE = re.compile(r'[^.]{41,}')
+
+# Max in-flight OpenAI requests per extractor, across all uploads (keeps us under rate limits)
+MAX_CONCURRENT_REQUESTS = 5
+
+# Rows per INSERT executemany when storing generated questions (bounds memory per batch)
+QUESTION_INSERT_BATCH_SIZE = 2000
+
+# Above this many question rows, Postgres gets them through COPY instead of INSERT
+QUESTION_COPY_THRESHOLD = 100
+QUESTION_COPY_COLUMNS = ('id', 'concept_id', 'mode', 'question_text', 'answer_text', 'difficulty', 'question_data')
+
+# Connection pool for the OpenAI client, shared by all concurrent uploads
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+# Tokens repeated from the end of one text chunk at the start of the next, so a
+# concept that straddles a chunk boundary is seen whole at least once
+CHUNK_OVERLAP_TOKENS = 64
+
+# Transient OpenAI failures worth retrying (timeouts are a kind of connection error);
+# bad requests and auth errors fail immediately
+RETRYABLE_OPENAI_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+# JSON mode: the API guarantees a parseable JSON object (no markdown fences)
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Question templates as (mode, question_fmt, answer_fmt), formatted per concept.
+# Placeholders: name, sent0/sent1 (first/second sentence), first_two,
+# def_N (first N chars of the definition)
+QUESTION_TEMPLATES = (
+    # RAPID_FIRE - Quick recall questions
+    ('RAPID_FIRE', "What is {name}?", "{sent0}"),
+    ('RAPID_FIRE', "Define {name}.", "{def_120}"),
+    ('RAPID_FIRE', "Briefly explain {name}.", "{sent0}"),
+    ('RAPID_FIRE', "{name} means?", "{def_100}"),
+    ('RAPID_FIRE', "In one sentence, what is {name}?", "{sent0}"),
+    ('RAPID_FIRE', "Quick recall: {name}", "{def_80}"),
+
+    # GUIDED_SOLVE - Understanding questions
+    ('GUIDED_SOLVE', "Explain what {name} means in your own words.", "{def_200}"),
+    ('GUIDED_SOLVE', "Describe the key aspects of {name}.", "Key aspects: {def_220}"),
+    ('GUIDED_SOLVE', "What should someone know about {name}?", "Important to know: {def_200}"),
+    ('GUIDED_SOLVE', "Break down the meaning of {name}.", "{first_two}"),
+
+    # COLLABORATIVE - Discussion questions
+    ('COLLABORATIVE', "What do you understand about {name}?", "{def_200}"),
+    ('COLLABORATIVE', "Share your thoughts on {name}.", "Key points: {def_180}"),
+    ('COLLABORATIVE', "How would you explain {name} to someone else?", "{def_220}"),
+
+    # EXPLAIN_BACK - Teaching-style questions
+    ('EXPLAIN_BACK', "If you were teaching {name}, what would you say?", "{def_200}"),
+    ('EXPLAIN_BACK', "Explain {name} in simple terms.", "{sent0}"),
+    ('EXPLAIN_BACK', "How would you describe {name} to a beginner?", "In simple terms: {sent0}"),
+    ('EXPLAIN_BACK', "Put {name} into your own words.", "{def_200}"),
+
+    # FILL_STORY - Completion questions
+    ('FILL_STORY', "{name} is defined as ___", "{sent0}"),
+    ('FILL_STORY', "Complete this: {name} means ___", "{def_100}"),
+    ('FILL_STORY', "Fill in the blank: {name} refers to ___", "{sent0}"),
+    ('FILL_STORY', "The term {name} describes ___", "{def_150}"),
+
+    # NUMBER_SWAP - Application questions
+    ('NUMBER_SWAP', "How is {name} used or applied?", "Application: {def_180}"),
+    ('NUMBER_SWAP', "Give a practical example of {name}.", "Example: {def_150}"),
+    ('NUMBER_SWAP', "Where might you encounter {name}?", "You might encounter this in: {def_160}"),
+
+    # SPOT_ERROR - Critical thinking
+    ('SPOT_ERROR', "What would be a misunderstanding of {name}?", "A misunderstanding would be ignoring that {def_180}"),
+    ('SPOT_ERROR', "What detail about {name} is often overlooked?", "Important detail: {sent1}"),
+    ('SPOT_ERROR', "What's important to remember about {name}?", "Remember: {def_170}"),
+
+    # BUILD_MAP - Connections
+    ('BUILD_MAP', "How does {name} connect to the broader topic?", "Connection: {def_200}"),
+    ('BUILD_MAP', "What role does {name} play in the material?", "Role: {def_180}"),
+
+    # MICRO_WINS - Easy confidence builders
+    ('MICRO_WINS', "Can you identify what {name} is about?", "Yes, it's about {sent0}"),
+    ('MICRO_WINS', "Do you recognize the term {name}?", "Yes, {name} relates to {sent0}"),
+    ('MICRO_WINS', "Is {name} covered in this material?", "Yes, {def_80}"),
+)
+
+# (length, placeholder) for every def_N used in QUESTION_TEMPLATES
+DEF_PREFIX_KEYS = tuple((n, 'def_%d' % n) for n in (80, 100, 120, 150, 160, 170, 180, 200, 220))
+
+
+# Per-mode instructions for AI question generation; the concept summary is
+# appended after them (see _build_mode_prompt). Placeholder: count
+MODE_PROMPTS = {
+    'RAPID_FIRE': """Generate {count} rapid-fire recall questions that can be answered in one word or short phrase.
+These should test immediate recall of key facts.
+
+Return JSON array:
+[
+  {{
+    "question": "What is...",
+    "answer": "short answer",
+    "difficulty": 3,
+    "data": {{"type": "rapid_fire"}}
+  }}
+]
+""",
+
+    'FILL_STORY': """Generate {count} fill-in-the-blank questions embedded in a contextual sentence or story.
+The blank should be the key concept or term.
+
+Return JSON array:
+[
+  {{
+    "question": "In a right triangle, the _____ is the longest side.",
+    "answer": "hypotenuse",
+    "difficulty": 4,
+    "data": {{"type": "fill_blank", "context": "geometry"}}
+  }}
+]
+""",
+
+    'EXPLAIN_BACK': """Generate {count} questions asking the student to explain the concept in their own words.
+These test deep understanding, not memorization.
+
+Return JSON array:
+[
+  {{
+    "question": "Explain in your own words what the Pythagorean theorem tells us about right triangles.",
+    "answer": "A model answer explaining the concept clearly",
+    "difficulty": 6,
+    "data": {{"type": "explain", "requires": "understanding"}}
+  }}
+]
+""",
+
+    'NUMBER_SWAP': """Generate {count} questions that apply formulas or calculations with different numbers.
+Test ability to use the concept, not just recall it.
+
+Return JSON array:
+[
+  {{
+    "question": "Find the hypotenuse of a right triangle with sides 5 and 12.",
+    "answer": "13",
+    "difficulty": 5,
+    "data": {{"type": "calculation", "values": {{"a": 5, "b": 12}}}}
+  }}
+]
+""",
+
+    'SPOT_ERROR': """Generate {count} questions with an intentional error that the student must identify.
+This tests critical thinking and deep understanding.
+
+Return JSON array:
+[
+  {{
+    "question": "A student says: 'In a right triangle with sides 3 and 4, the hypotenuse is 5 because 3+4=7, and 7+5=12.' What's wrong with this reasoning?",
+    "answer": "The student added sides instead of using the Pythagorean theorem (a² + b² = c²). The correct calculation is 3² + 4² = 9 + 16 = 25 = 5².",
+    "difficulty": 7,
+    "data": {{"type": "error_detection", "error_type": "wrong_operation"}}
+  }}
+]
+""",
+
+    'BUILD_MAP': """Generate {count} questions asking student to show relationships between this concept and related concepts.
+Tests ability to see the bigger picture.
+
+Return JSON array:
+[
+  {{
+    "question": "How does the Pythagorean theorem relate to: (a) distance formula, (b) trigonometry, (c) circles?",
+    "answer": "Model answer showing connections",
+    "difficulty": 8,
+    "data": {{"type": "relationships", "related": ["distance formula", "trigonometry", "circles"]}}
+  }}
+]
+""",
+}
+
+
+def get_openai_client() -> Optional[AsyncOpenAI]:
+    """
+    Shared AsyncOpenAI client, or None when OPENAI_API_KEY is not set
+
+    Created on first use (after main.py has loaded .env) and reused by every
+    extractor, so all requests share one keep-alive connection pool.
+    """
+    global _openai_client
+    if _openai_client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            return None
+        _openai_client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=2,
+            timeout=60,
+            http_client=DefaultAsyncHttpxClient(limits=OPENAI_HTTP_LIMITS)
+        )
+    return _openai_client
 
 
 class ConceptExtractor:
     """Extract concepts and generate questions using AI"""
 
     def __init__(self):
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        self.model = "gpt-4"
+        # Concept extraction needs the stronger model; structured question writing
+        # does fine on a much faster, cheaper one. Both need JSON mode support.
+        self.extract_model = os.getenv("EXTRACT_MODEL", "gpt-4o")
+        self.gen_model = os.getenv("GEN_MODEL", "gpt-4o-mini")
+        # Shared by every upload so concurrent uploads don't multiply the request rate
+        self.request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    @property
+    def client(self) -> Optional[AsyncOpenAI]:
+        """Shared OpenAI client (None without an API key)"""
+        return get_openai_client()
 
     async def extract_concepts(self, pdf_data: Dict, material_id: uuid.UUID, db: Session) -> List[Concept]:
         """
@@ -28,17 +267,15 @@ class ConceptExtractor:
         - Important facts and statements
         - Concepts with explanations
         """
-        print(f"=" * 60)
-        print(f"CONCEPT EXTRACTION STARTED for material_id: {material_id}")
-        print(f"PDF Data keys: {pdf_data.keys()}")
-
         text = pdf_data.get('text', '')
-        print(f"Text length: {len(text)}")
-        print(f"Text preview (first 200 chars): {text[:200]}")
+
+        logger.info("Concept extraction started for material_id %s (%d chars)", material_id, len(text))
+        logger.debug("Text preview (first 200 chars): %.200s", text)
 
         if not text or len(text.strip()) < 10:
-            print("WARNING: Minimal or no text content in PDF - creating dummy concept")
+            logger.warning("Minimal or no text content in PDF - creating dummy concept")
             dummy_concept = Concept(
+                id=uuid.uuid4(),
                 material_id=material_id,
                 name="Sample Learning",
                 type="concept",
@@ -48,64 +285,55 @@ class ConceptExtractor:
                 complexity=3,
                 domain="general"
             )
-            db.add(dummy_concept)
-            db.flush()
-            print(f"Created dummy concept with ID: {dummy_concept.id}")
-            db.commit()
-            verification = db.query(Concept).filter(Concept.material_id == material_id).count()
-            print(f"Verification: {verification} concepts in database")
+            await asyncio.to_thread(_commit_concepts, db, [dummy_concept])
+            logger.debug("Created dummy concept with ID: %s", dummy_concept.id)
             return [dummy_concept]
 
         all_concepts = []
 
         # Strategy 1: Look for definition patterns
-        import re
 
         # Find sentences with definition patterns
-        definition_patterns = [
-            r'([A-Z][a-zA-Z\s]{2,30})\s+is\s+([^.]{20,200})\.',
-            r'([A-Z][a-zA-Z\s]{2,30})\s+refers to\s+([^.]{20,200})\.',
-            r'([A-Z][a-zA-Z\s]{2,30})\s+means\s+([^.]{20,200})\.',
-            r'([A-Z][a-zA-Z\s]{2,30}):\s+([^.]{20,200})\.',
-        ]
-
-        for pattern in definition_patterns:
-            matches = re.finditer(pattern, text[:5000])  # Search first 5000 chars
-            for match in matches:
-                if len(all_concepts) >= 15:
-                    break
-                term = match.group(1).strip()
-                definition = match.group(2).strip()
-
-                # Skip if term is too generic
-                if len(term.split()) > 6 or len(term) < 3:
-                    continue
+        seen_terms = set()
+        for match in DEFINITION_RE.finditer(text[:5000]):  # Search first 5000 chars
+            if len(all_concepts) >= 15:
+                break
+            term = match.group(1).strip()
+            definition = match.group(2).strip()
+
+            # Skip if term is too generic or already found
+            if len(term.split()) > 6 or len(term) < 3 or term.lower() in seen_terms:
+                continue
+            seen_terms.add(term.lower())
 
-                concept = Concept(
-                    material_id=material_id,
-                    name=term,
-                    type="definition",
-                    full_name=term,
-                    definition=definition,
-                    context=f"{term} is {definition[:100]}",
-                    complexity=5,
-                    domain="general"
-                )
-                db.add(concept)
-                all_concepts.append(concept)
-                print(f"  [DEF] Found: {term}")
+            concept = Concept(
+                id=uuid.uuid4(),
+                material_id=material_id,
+                name=term,
+                type="definition",
+                full_name=term,
+                definition=definition,
+                context=f"{term} is {definition[:100]}",
+                complexity=5,
+                domain="general"
+            )
+            all_concepts.append(concept)
+            logger.debug("  [DEF] Found: %s", term)
 
         # Strategy 2: Extract important sentences (if we don't have enough concepts yet)
         if len(all_concepts) < 10:
-            print("Finding important sentences...")
-            sentences = [s.strip() + '.' for s in text.split('.') if len(s.strip()) > 40]
+            logger.debug("Finding important sentences...")
+            # Only the first 20 sentences are used; don't split the whole document
+            sentences = islice(
+                (s + '.' for s in (m.group().strip() for m in LONG_SENTENCE_RE.finditer(text)) if len(s) > 40), 20
+            )
 
-            for i, sentence in enumerate(sentences[:20]):
+            for i, sentence in enumerate(sentences):
                 if len(all_concepts) >= 15:
                     break
 
                 # Extract a short name from the sentence
-                words = sentence.split()[:5]  # First 5 words
+                words = sentence.split(None, 5)[:5]  # First 5 words
                 name = ' '.join(words).strip(',.:;')
 
                 # Skip if name is too long
@@ -113,6 +341,7 @@ class ConceptExtractor:
                     name = ' '.join(words[:3])
 
                 concept = Concept(
+                    id=uuid.uuid4(),
                     material_id=material_id,
                     name=name,
                     type="fact",
@@ -122,24 +351,26 @@ class ConceptExtractor:
                     complexity=5,
                     domain="general"
                 )
-                db.add(concept)
                 all_concepts.append(concept)
-                print(f"  [FACT {i+1}] {name[:50]}")
+                logger.debug("  [FACT %d] %.50s", i + 1, name)
 
         # Strategy 3: If still not enough, extract from paragraphs
         if len(all_concepts) < 5:
-            print("Extracting from paragraphs...")
-            paragraphs = [p.strip() for p in text.split('\n\n') if len(p.strip()) > 50]
+            logger.debug("Extracting from paragraphs...")
+            paragraphs = islice(
+                (p.strip() for p in _iter_split(text, '\n\n') if len(p.strip()) > 50), 10
+            )
 
-            for i, paragraph in enumerate(paragraphs[:10]):
+            for i, paragraph in enumerate(paragraphs):
                 # Extract topic from first few words
-                words = paragraph.split()[:4]
+                words = paragraph.split(None, 4)[:4]  # Don't split the whole paragraph
                 topic = ' '.join(words).strip(',.:;')
 
                 if len(topic) > 40:
                     topic = ' '.join(words[:2])
 
                 concept = Concept(
+                    id=uuid.uuid4(),
                     material_id=material_id,
                     name=topic,
                     type="topic",
@@ -149,14 +380,14 @@ class ConceptExtractor:
                     complexity=5,
                     domain="general"
                 )
-                db.add(concept)
                 all_concepts.append(concept)
-                print(f"  [TOPIC {i+1}] {topic[:50]}")
+                logger.debug("  [TOPIC %d] %.50s", i + 1, topic)
 
         # Ensure we have at least one concept
         if not all_concepts:
-            print("Creating fallback concept...")
+            logger.debug("Creating fallback concept...")
             concept = Concept(
+                id=uuid.uuid4(),
                 material_id=material_id,
                 name="Document Content",
                 type="general",
@@ -166,28 +397,113 @@ class ConceptExtractor:
                 complexity=5,
                 domain="general"
             )
-            db.add(concept)
             all_concepts.append(concept)
 
-        print(f"Committing {len(all_concepts)} concepts to database...")
-        db.flush()
-        db.commit()
-        print(f"Successfully committed {len(all_concepts)} concepts")
+        await asyncio.to_thread(_commit_concepts, db, all_concepts)
 
-        verification_count = db.query(Concept).filter(Concept.material_id == material_id).count()
-        print(f"Verification: {verification_count} concepts in database")
-        print(f"=" * 60)
+        logger.info("Committed %d concepts for material_id %s", len(all_concepts), material_id)
 
         return all_concepts
 
     async def extract_concepts_with_ai(self, pdf_data: Dict, material_id: uuid.UUID, db: Session) -> List[Concept]:
-        """AI-powered extraction (requires OpenAI) - DEPRECATED"""
+        """AI-powered extraction (requires OpenAI; used when AI_CONCEPTS=1)"""
         text = pdf_data['text']
-        chunks = self._chunk_text(text, max_tokens=6000)
+
+        cache_key = content_key("ai_concepts", CACHE_VERSION, text)
+        cached = await self._load_cached_concepts(cache_key, material_id, db)
+        if cached is not None:
+            return cached
+
         all_concepts = []
 
-        for chunk in chunks:
-            prompt = f"""You are an expert learning scientist. Analyze this educational content and extract ALL testable concepts.
+        # Chunks are independent, so request them concurrently (bounded for rate limits)
+        async def extract_bounded(chunk: str) -> List[Dict]:
+            async with self.request_slots:
+                return await self._extract_chunk(chunk)
+
+        # Each task holds only its own chunk and releases it once the request completes
+        tasks = [
+            asyncio.create_task(extract_bounded(chunk))
+            for chunk in _iter_chunks(text, max_tokens=6000, encoding=_get_encoding(self.extract_model))
+        ]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        concepts_by_name = {}
+        for result in results:
+            if isinstance(result, Exception):
+                e = result
+                logger.error("Error extracting concepts from chunk: %r", e)
+                # Don't silently continue - we need at least some concepts
+                if "invalid_api_key" in str(e).lower() or "authentication" in str(e).lower():
+                    raise Exception(f"OpenAI API key error: {str(e)}. Please check your OPENAI_API_KEY in Render environment variables.")
+                continue
+
+            # Create Concept objects; repeats from overlapping chunks are merged
+            # into the first occurrence instead of becoming extra rows
+            for concept_data in result:
+                seen_key = (concept_data.get('full_name') or concept_data.get('name') or '').strip().lower()
+                existing = concepts_by_name.get(seen_key)
+                if existing is not None:
+                    existing.related_concepts = _unique_strings(existing.related_concepts, concept_data.get('related_concepts'))
+                    existing.dependencies = _unique_strings(existing.dependencies, concept_data.get('dependencies'))
+                    continue
+
+                concept = Concept(
+                    id=uuid.uuid4(),
+                    material_id=material_id,
+                    name=concept_data.get('name'),
+                    type=_intern(concept_data.get('type')),
+                    full_name=concept_data.get('full_name'),
+                    definition=concept_data.get('definition'),
+                    context=concept_data.get('context'),
+                    complexity=concept_data.get('complexity', 5),
+                    domain=_intern(concept_data.get('domain')),
+                    formulas=concept_data.get('formulas', []),
+                    examples=concept_data.get('examples', []),
+                    related_concepts=_unique_strings(concept_data.get('related_concepts')),
+                    dependencies=_unique_strings(concept_data.get('dependencies'))
+                )
+                all_concepts.append(concept)
+                if seen_key:
+                    concepts_by_name[seen_key] = concept
+
+        # Commit all concepts
+        await asyncio.to_thread(_commit_concepts, db, all_concepts)
+        if all_concepts:
+            await self._cache_concepts(cache_key, all_concepts)
+
+        return all_concepts
+
+    async def _load_cached_concepts(self, cache_key: str, material_id: uuid.UUID, db: Session) -> Optional[List[Concept]]:
+        """Copy previously extracted concepts for identical text onto this material"""
+        cached = await cache_get_json(cache_key)
+        if cached is None:
+            return None
+
+        concepts = [
+            Concept(id=uuid.uuid4(), material_id=material_id, **fields)
+            for fields in cached
+        ]
+        await asyncio.to_thread(_commit_concepts, db, concepts)
+
+        logger.info("Reused %d cached concepts (%s)", len(concepts), cache_key)
+
+        return concepts
+
+    async def _cache_concepts(self, cache_key: str, concepts: List[Concept]):
+        """Store extracted concept fields for reuse by identical uploads"""
+        await cache_set_json(cache_key, [
+            {
+                field: getattr(concept, field)
+                for field in CACHED_CONCEPT_FIELDS
+                if getattr(concept, field) is not None
+            }
+            for concept in concepts
+        ])
+
+    async def _extract_chunk(self, chunk: str) -> List[Dict]:
+        """Ask the model for the concepts in one chunk of text"""
+        prompt = f"""You are an expert learning scientist. Analyze this educational content and extract ALL testable concepts.
 
 For each concept, provide:
 1. name: Short identifier (2-5 words)
@@ -202,13 +518,10 @@ For each concept, provide:
 10. related_concepts: List of concept names this depends on or relates to
 11. dependencies: List of prerequisite concepts
 
-Content:
-{chunk}
-
-Return a JSON array of concepts. Be comprehensive - extract EVERY testable piece of knowledge.
+Return a JSON object with a "concepts" array. Be comprehensive - extract EVERY testable piece of knowledge.
 
 Example:
-[
+{{"concepts": [
   {{
     "name": "Pythagorean Theorem",
     "type": "theorem",
@@ -222,71 +535,74 @@ Example:
     "related_concepts": ["right triangle", "hypotenuse", "squares"],
     "dependencies": ["basic algebra", "square roots"]
   }}
-]
+]}}
+
+Content:
+{chunk}
 """
 
-            try:
-                response = openai.ChatCompletion.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "You are an expert at analyzing educational content and extracting testable concepts. Always respond with valid JSON."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3
-                )
+        result = await self._complete_json([
+            {"role": "system", "content": "You are an expert at analyzing educational content and extracting testable concepts. Always respond with valid JSON."},
+            {"role": "user", "content": prompt}
+        ], model=self.extract_model, temperature=0.3)
 
-                content = response.choices[0].message.content.strip()
-
-                # Extract JSON from response
-                if "```json" in content:
-                    content = content.split("```json")[1].split("```")[0].strip()
-                elif "```" in content:
-                    content = content.split("```")[1].split("```")[0].strip()
-
-                concepts_data = json.loads(content)
-
-                # Create Concept objects
-                for concept_data in concepts_data:
-                    concept = Concept(
-                        material_id=material_id,
-                        name=concept_data.get('name'),
-                        type=concept_data.get('type'),
-                        full_name=concept_data.get('full_name'),
-                        definition=concept_data.get('definition'),
-                        context=concept_data.get('context'),
-                        complexity=concept_data.get('complexity', 5),
-                        domain=concept_data.get('domain'),
-                        formulas=concept_data.get('formulas', []),
-                        examples=concept_data.get('examples', []),
-                        related_concepts=concept_data.get('related_concepts', []),
-                        dependencies=concept_data.get('dependencies', [])
-                    )
-                    db.add(concept)
-                    all_concepts.append(concept)
-
-            except Exception as e:
-                error_msg = f"Error extracting concepts from chunk: {str(e)}"
-                print(error_msg)
-                print(f"Error type: {type(e).__name__}")
-                print(f"Full error: {repr(e)}")
-                # Don't silently continue - we need at least some concepts
-                if "invalid_api_key" in str(e).lower() or "authentication" in str(e).lower():
-                    raise Exception(f"OpenAI API key error: {str(e)}. Please check your OPENAI_API_KEY in Render environment variables.")
-                continue
+        return result.get('concepts', [])
 
-        # Commit all concepts
-        db.commit()
+    async def _complete_json(self, messages: List[Dict], model: str, temperature: float) -> Dict:
+        """
+        JSON-mode chat completion, cached by model, temperature and messages
 
-        return all_concepts
+        Identical prompts (shared textbook sections, repeated concepts) are
+        answered from the cache without an API call.
+        """
+        cache_key = content_key(
+            "completion",
+            CACHE_VERSION,
+            "%s|%s|%s" % (model, temperature, orjson.dumps(messages).decode())
+        )
+        cached = await cache_get_json(cache_key)
+        if cached is not None:
+            return cached
+
+        if self.client is None:
+            raise RuntimeError("OpenAI authentication failed: OPENAI_API_KEY is not set")
+
+        result = orjson.loads(await self._stream_completion(messages, model, temperature))
+        await cache_set_json(cache_key, result)
+
+        return result
+
+    @retry(
+        retry=retry_if_exception_type(RETRYABLE_OPENAI_ERRORS),
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(6),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+        reraise=True
+    )
+    async def _stream_completion(self, messages: List[Dict], model: str, temperature: float) -> str:
+        """
+        Text of a JSON-mode completion, retried with jittered backoff on 429s,
+        5xx and dropped connections (tenacity owns retries here, not the SDK)
+        """
+        # Streamed so the timeout applies between tokens, not to the whole
+        # (often long) response; the JSON is parsed once it is complete
+        stream = await self.client.with_options(max_retries=0).chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            response_format=JSON_RESPONSE_FORMAT,
+            stream=True
+        )
+        return ''.join([chunk.choices[0].delta.content or '' async for chunk in stream if chunk.choices])
 
     async def generate_questions(self, concepts: List[Concept], db: Session):
         """
         Generate meaningful, contextual questions for each concept
         Creates questions that make sense and test real understanding
         """
-        print(f"=" * 60)
-        print(f"GENERATING QUESTIONS for {len(concepts)} concepts")
+        logger.info("Generating questions for %d concepts", len(concepts))
 
+        question_rows = []
         for concept in concepts:
             # Get content
             full_def = concept.definition or concept.full_name or "No definition available"
@@ -294,122 +610,120 @@ Example:
 
             # Clean up the name if it's too long
             if len(name) > 50:
-                name = ' '.join(name.split()[:5])
-
-            # Split definition into sentences for varied answers
-            sentences = [s.strip() + '.' for s in full_def.split('.') if s.strip()]
-            if not sentences:
-                sentences = [full_def]
+                name = ' '.join(name.split(None, 5)[:5])
+
+            # The templates only use the first two sentences, so stop splitting there.
+            # Single-sentence definitions without a period skip the splitter entirely.
+            if '.' in full_def:
+                sentences = [
+                    m.group().strip() + '.' for m in islice(SENTENCE_RE.finditer(full_def), 2)
+                ] or [full_def]
+            else:
+                sentences = [full_def.strip() + '.'] if full_def.strip() else [full_def]
+
+            # Precompute the definition prefixes and sentences the templates reuse
+            ctx = {key: full_def[:n] for n, key in DEF_PREFIX_KEYS}
+            ctx['name'] = name
+            if len(sentences) > 1:
+                sent0, sent1 = sentences
+                ctx['sent0'] = sent0
+                ctx['sent1'] = sent1
+                ctx['first_two'] = "%s %s" % (sent0, sent1)
+            else:
+                ctx['sent0'] = sentences[0]
+                ctx['sent1'] = ctx['def_160']
+                ctx['first_two'] = ctx['def_200']
 
-            def get_answer_part(index, default):
-                if index < len(sentences):
-                    return sentences[index]
-                return default
+            logger.debug("  Creating %d questions for: %.60s", len(QUESTION_TEMPLATES), concept.name)
 
             # Generate MEANINGFUL questions with UNIQUE answers
-            modes_and_questions = [
-                # RAPID_FIRE - Quick recall questions
-                {'mode': 'RAPID_FIRE', 'question': f"What is {name}?", 'answer': get_answer_part(0, full_def[:150])},
-                {'mode': 'RAPID_FIRE', 'question': f"Define {name}.", 'answer': full_def[:120]},
-                {'mode': 'RAPID_FIRE', 'question': f"Briefly explain {name}.", 'answer': get_answer_part(0, full_def[:100])},
-                {'mode': 'RAPID_FIRE', 'question': f"{name} means?", 'answer': full_def[:100]},
-                {'mode': 'RAPID_FIRE', 'question': f"In one sentence, what is {name}?", 'answer': get_answer_part(0, concept.full_name or name)},
-                {'mode': 'RAPID_FIRE', 'question': f"Quick recall: {name}", 'answer': full_def[:80]},
-
-                # GUIDED_SOLVE - Understanding questions
-                {'mode': 'GUIDED_SOLVE', 'question': f"Explain what {name} means in your own words.", 'answer': full_def[:200]},
-                {'mode': 'GUIDED_SOLVE', 'question': f"Describe the key aspects of {name}.", 'answer': f"Key aspects: {full_def[:220]}"},
-                {'mode': 'GUIDED_SOLVE', 'question': f"What should someone know about {name}?", 'answer': f"Important to know: {full_def[:200]}"},
-                {'mode': 'GUIDED_SOLVE', 'question': f"Break down the meaning of {name}.", 'answer': ' '.join(sentences[:2]) if len(sentences) > 1 else full_def[:200]},
-
-                # COLLABORATIVE - Discussion questions
-                {'mode': 'COLLABORATIVE', 'question': f"What do you understand about {name}?", 'answer': full_def[:200]},
-                {'mode': 'COLLABORATIVE', 'question': f"Share your thoughts on {name}.", 'answer': f"Key points: {full_def[:180]}"},
-                {'mode': 'COLLABORATIVE', 'question': f"How would you explain {name} to someone else?", 'answer': full_def[:220]},
-
-                # EXPLAIN_BACK - Teaching-style questions
-                {'mode': 'EXPLAIN_BACK', 'question': f"If you were teaching {name}, what would you say?", 'answer': full_def[:200]},
-                {'mode': 'EXPLAIN_BACK', 'question': f"Explain {name} in simple terms.", 'answer': get_answer_part(0, full_def[:150])},
-                {'mode': 'EXPLAIN_BACK', 'question': f"How would you describe {name} to a beginner?", 'answer': f"In simple terms: {get_answer_part(0, full_def[:180])}"},
-                {'mode': 'EXPLAIN_BACK', 'question': f"Put {name} into your own words.", 'answer': full_def[:200]},
-
-                # FILL_STORY - Completion questions
-                {'mode': 'FILL_STORY', 'question': f"{name} is defined as ___", 'answer': get_answer_part(0, full_def[:120])},
-                {'mode': 'FILL_STORY', 'question': f"Complete this: {name} means ___", 'answer': full_def[:100]},
-                {'mode': 'FILL_STORY', 'question': f"Fill in the blank: {name} refers to ___", 'answer': get_answer_part(0, full_def[:100])},
-                {'mode': 'FILL_STORY', 'question': f"The term {name} describes ___", 'answer': full_def[:150]},
-
-                # NUMBER_SWAP - Application questions
-                {'mode': 'NUMBER_SWAP', 'question': f"How is {name} used or applied?", 'answer': f"Application: {full_def[:180]}"},
-                {'mode': 'NUMBER_SWAP', 'question': f"Give a practical example of {name}.", 'answer': f"Example: {full_def[:150]}"},
-                {'mode': 'NUMBER_SWAP', 'question': f"Where might you encounter {name}?", 'answer': f"You might encounter this in: {full_def[:160]}"},
-
-                # SPOT_ERROR - Critical thinking
-                {'mode': 'SPOT_ERROR', 'question': f"What would be a misunderstanding of {name}?", 'answer': f"A misunderstanding would be ignoring that {full_def[:180]}"},
-                {'mode': 'SPOT_ERROR', 'question': f"What detail about {name} is often overlooked?", 'answer': f"Important detail: {get_answer_part(1, full_def[:160])}"},
-                {'mode': 'SPOT_ERROR', 'question': f"What's important to remember about {name}?", 'answer': f"Remember: {full_def[:170]}"},
-
-                # BUILD_MAP - Connections
-                {'mode': 'BUILD_MAP', 'question': f"How does {name} connect to the broader topic?", 'answer': f"Connection: {full_def[:200]}"},
-                {'mode': 'BUILD_MAP', 'question': f"What role does {name} play in the material?", 'answer': f"Role: {full_def[:180]}"},
-
-                # MICRO_WINS - Easy confidence builders
-                {'mode': 'MICRO_WINS', 'question': f"Can you identify what {name} is about?", 'answer': f"Yes, it's about {get_answer_part(0, full_def[:100])}"},
-                {'mode': 'MICRO_WINS', 'question': f"Do you recognize the term {name}?", 'answer': f"Yes, {name} relates to {get_answer_part(0, 'this concept')}"},
-                {'mode': 'MICRO_WINS', 'question': f"Is {name} covered in this material?", 'answer': f"Yes, {full_def[:80]}"},
-            ]
-
-            print(f"  Creating {len(modes_and_questions)} questions for: {concept.name[:60]}")
-
-            for q_data in modes_and_questions:
-                question = Question(
-                    concept_id=concept.id,
-                    mode=q_data['mode'],
-                    question_text=q_data['question'],
-                    answer_text=q_data['answer'],
-                    difficulty=concept.complexity,
-                    question_data={}
-                )
-                db.add(question)
+            question_rows.extend(
+                {
+                    'concept_id': concept.id,
+                    'mode': mode,
+                    'question_text': question_fmt.format_map(ctx),
+                    'answer_text': answer_fmt.format_map(ctx),
+                    'difficulty': concept.complexity,
+                    'question_data': {}
+                }
+                for mode, question_fmt, answer_fmt in QUESTION_TEMPLATES
+            )
 
-        db.commit()
-        print(f"Questions generated successfully!")
-        print(f"=" * 60)
+        await asyncio.to_thread(_commit_questions, db, question_rows)
+        logger.info("Generated %d questions", len(question_rows))
 
-    async def _generate_mode_questions(self, concept: Concept, mode: str, count: int = 2) -> List[Dict]:
-        """Generate questions for specific mode"""
+    async def generate_questions_with_ai(self, concepts: List[Concept], db: Session) -> int:
+        """AI-written questions for every concept and mode (requires OpenAI); returns the count"""
+        logger.info("Generating AI questions for %d concepts", len(concepts))
 
-        prompt = self._get_mode_prompt(concept, mode, count)
+        # One request per concept covers every mode; concepts run concurrently
+        async def generate_bounded(concept: Concept) -> Dict[str, List[Dict]]:
+            async with self.request_slots:
+                return await self._generate_all_modes(concept)
 
+        results = await asyncio.gather(
+            *(generate_bounded(concept) for concept in concepts),
+            return_exceptions=True
+        )
+
+        question_rows = []
+        for concept, result in zip(concepts, results):
+            if isinstance(result, Exception):
+                logger.error("Error generating questions for %s: %r", concept.name, result)
+                continue
+
+            question_rows.extend(_all_modes_question_rows(concept, result))
+
+        await asyncio.to_thread(_commit_questions, db, question_rows)
+        logger.info("Generated %d AI questions", len(question_rows))
+
+        return len(question_rows)
+
+    async def _generate_all_modes(self, concept: Concept, count: int = 2) -> Dict[str, List[Dict]]:
+        """Generate questions for every mode in one request, keyed by mode"""
         try:
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at creating effective learning questions. Always respond with valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7
+            questions_by_mode = await self._complete_json(
+                self._all_modes_messages(concept, count), model=self.gen_model, temperature=0.7
             )
+            return questions_by_mode if isinstance(questions_by_mode, dict) else {}
 
-            content = response.choices[0].message.content.strip()
-
-            # Extract JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
+        except Exception as e:
+            logger.error("Error generating questions: %s", e)
+            return {}
 
-            questions = json.loads(content)
-            return questions
+    async def _generate_mode_questions(self, concept: Concept, mode: str, count: int = 2) -> List[Dict]:
+        """Generate questions for specific mode"""
+        try:
+            result = await self._complete_json(
+                self._question_messages(concept, mode, count), model=self.gen_model, temperature=0.7
+            )
+            return result.get('questions', [])
 
         except Exception as e:
-            print(f"Error generating questions: {e}")
+            logger.error("Error generating questions: %s", e)
             return []
 
+    def _question_messages(self, concept: Concept, mode: str, count: int) -> List[Dict]:
+        """Chat messages asking for one mode's questions about a concept"""
+        return [
+            {"role": "system", "content": "You are an expert at creating effective learning questions. Always respond with valid JSON."},
+            {"role": "user", "content": self._get_mode_prompt(concept, mode, count) + '\nWrap the array in a JSON object: {"questions": [...]}'}
+        ]
+
+    def _all_modes_messages(self, concept: Concept, count: int) -> List[Dict]:
+        """Chat messages asking for every mode's questions about a concept at once"""
+        return [
+            {"role": "system", "content": "You are an expert at creating effective learning questions. Always respond with valid JSON."},
+            {"role": "user", "content": _build_all_modes_prompt(count, self._concept_info(concept))}
+        ]
+
     def _get_mode_prompt(self, concept: Concept, mode: str, count: int) -> str:
         """Get prompt for specific question mode"""
+        return _build_mode_prompt(mode, count, self._concept_info(concept))
 
-        base_info = f"""Concept: {concept.name}
+    def _concept_info(self, concept: Concept) -> str:
+        """Concept summary shared by the question prompts"""
+        return f"""Concept: {concept.name}
 Type: {concept.type}
 Definition: {concept.definition}
 Context: {concept.context}
@@ -417,133 +731,263 @@ Formulas: {concept.formulas}
 Examples: {concept.examples}
 """
 
-        if mode == 'RAPID_FIRE':
-            return f"""{base_info}
-
-Generate {count} rapid-fire recall questions that can be answered in one word or short phrase.
-These should test immediate recall of key facts.
-
-Return JSON array:
-[
-  {{
-    "question": "What is...",
-    "answer": "short answer",
-    "difficulty": 3,
-    "data": {{"type": "rapid_fire"}}
-  }}
-]
-"""
-
-        elif mode == 'FILL_STORY':
-            return f"""{base_info}
-
-Generate {count} fill-in-the-blank questions embedded in a contextual sentence or story.
-The blank should be the key concept or term.
-
-Return JSON array:
-[
-  {{
-    "question": "In a right triangle, the _____ is the longest side.",
-    "answer": "hypotenuse",
-    "difficulty": 4,
-    "data": {{"type": "fill_blank", "context": "geometry"}}
-  }}
-]
-"""
-
-        elif mode == 'EXPLAIN_BACK':
-            return f"""{base_info}
 
-Generate {count} questions asking the student to explain the concept in their own words.
-These test deep understanding, not memorization.
+def _ai_question_rows(concept: Concept, mode: str, questions: List[Dict]) -> List[Dict]:
+    """Question rows for the model's questions, skipping entries without question text"""
+    return [
+        {
+            'concept_id': concept.id,
+            'mode': mode,
+            'question_text': q['question'],
+            'answer_text': q.get('answer'),
+            'difficulty': q.get('difficulty', concept.complexity),
+            'question_data': q.get('data') or {}
+        }
+        for q in questions
+        if isinstance(q, dict) and q.get('question')
+    ]
+
+
+def _all_modes_question_rows(concept: Concept, questions_by_mode: Dict) -> List[Dict]:
+    """Question rows from an all-modes response, ignoring unknown or malformed modes"""
+    rows = []
+    if not isinstance(questions_by_mode, dict):
+        return rows
+    for mode in MODE_PROMPTS:
+        questions = questions_by_mode.get(mode)
+        if isinstance(questions, list):
+            rows.extend(_ai_question_rows(concept, mode, questions))
+    return rows
+
+
+def _unique_strings(*lists: Optional[List]) -> List[str]:
+    """
+    Order-preserving union of name lists; the names are interned since the
+    same related concepts and prerequisites recur across many concepts
+    """
+    unique = {}
+    for items in lists:
+        for item in items or ():
+            if isinstance(item, str) and item.strip():
+                unique.setdefault(sys.intern(item.strip()), None)
+    return list(unique)
+
+
+def _intern(value):
+    """Intern small-vocabulary strings (concept type, domain); other values pass through"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _commit_concepts(db: Session, concepts: List[Concept]):
+    """
+    Insert concepts and commit. Blocking: async callers run it through
+    asyncio.to_thread so other uploads and API calls keep going meanwhile
+    """
+    _insert_concepts(db, concepts)
+    db.commit()
+
+
+def _commit_questions(db: Session, rows: List[Dict]):
+    """Insert question rows and commit (blocking, see _commit_concepts)"""
+    _insert_questions(db, rows)
+    db.commit()
+
+
+def _insert_concepts(db: Session, concepts: List[Concept]):
+    """
+    Insert concepts with one Core executemany, bypassing the ORM unit of work.
+
+    Ids are assigned client-side, so no RETURNING round-trip is needed and
+    the Concept objects stay usable (detached) for question generation.
+    """
+    if not concepts:
+        return
+
+    rows = [
+        {
+            'id': concept.id,
+            'material_id': concept.material_id,
+            'name': concept.name,
+            'type': concept.type,
+            'full_name': concept.full_name,
+            'definition': concept.definition,
+            'context': concept.context,
+            'complexity': concept.complexity,
+            'domain': concept.domain,
+            'formulas': concept.formulas or [],
+            'examples': concept.examples or [],
+            'related_concepts': concept.related_concepts or [],
+            'dependencies': concept.dependencies or []
+        }
+        for concept in concepts
+    ]
+    db.execute(insert(Concept.__table__), rows)
+
+
+def _insert_questions(db: Session, rows: List[Dict]):
+    """
+    Insert question rows with Core executemany in fixed-size batches.
+
+    SQLAlchemy packs each batch into multi-row INSERT ... VALUES statements,
+    so an upload's questions go out in a handful of round-trips. Large
+    batches on Postgres are streamed with COPY instead.
+    """
+    if len(rows) > QUESTION_COPY_THRESHOLD and db.get_bind().dialect.name == 'postgresql':
+        _copy_questions(db, rows)
+        return
+
+    for start in range(0, len(rows), QUESTION_INSERT_BATCH_SIZE):
+        db.execute(insert(Question.__table__), rows[start:start + QUESTION_INSERT_BATCH_SIZE])
+
+
+def _copy_questions(db: Session, rows: List[Dict]):
+    """
+    Stream question rows into Postgres with COPY ... FROM STDIN (CSV).
+
+    Runs on the session's own connection, so it commits or rolls back with
+    the rest of the upload. Python-side column defaults are applied here
+    since COPY bypasses them; created_at keeps its server default.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(map(_csv_field, (
+            row.get('id') or uuid.uuid4(),
+            row['concept_id'],
+            row['mode'],
+            row['question_text'],
+            row.get('answer_text'),
+            row.get('difficulty', 5),
+            orjson.dumps(row.get('question_data') or {}).decode()
+        ))))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    copy_sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (
+        Question.__tablename__, ', '.join(QUESTION_COPY_COLUMNS)
+    )
+    with db.connection().connection.cursor() as cursor:
+        cursor.copy_expert(copy_sql, buffer)
+
+
+def _csv_field(value) -> str:
+    """
+    One COPY CSV field: None becomes an unquoted empty field (NULL) and
+    everything else is quoted, so empty strings stay empty strings
+    """
+    if value is None:
+        return ''
+    return '"%s"' % str(value).replace('"', '""')
+
+
+def _iter_split(text: str, sep: str) -> Iterator[str]:
+    """Lazy str.split: yields the same pieces without building the full list"""
+    start = 0
+    while True:
+        end = text.find(sep, start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + len(sep)
+
+
+# Prompts put the fixed instructions first and the concept last, so every request
+# for a mode shares a long identical prefix that OpenAI's prompt cache can reuse
+def _build_mode_prompt(mode: str, count: int, base_info: str) -> str:
+    """Render a mode prompt: the mode's instructions followed by the concept info"""
+    instructions = _mode_instructions(mode, count)
+    if instructions is None:
+        return ""
+    return f"{instructions}\n{base_info}"
 
-Return JSON array:
-[
-  {{
-    "question": "Explain in your own words what the Pythagorean theorem tells us about right triangles.",
-    "answer": "A model answer explaining the concept clearly",
-    "difficulty": 6,
-    "data": {{"type": "explain", "requires": "understanding"}}
-  }}
-]
-"""
 
-        elif mode == 'NUMBER_SWAP':
-            return f"""{base_info}
+def _build_all_modes_prompt(count: int, base_info: str) -> str:
+    """Render one prompt covering every mode, sharing the concept info between them"""
+    return f"{_all_modes_instructions(count)}\n{base_info}"
 
-Generate {count} questions that apply formulas or calculations with different numbers.
-Test ability to use the concept, not just recall it.
 
-Return JSON array:
-[
-  {{
-    "question": "Find the hypotenuse of a right triangle with sides 5 and 12.",
-    "answer": "13",
-    "difficulty": 5,
-    "data": {{"type": "calculation", "values": {{"a": 5, "b": 12}}}}
-  }}
-]
-"""
+@lru_cache(maxsize=64)
+def _mode_instructions(mode: str, count: int) -> Optional[str]:
+    """A mode's concept-independent instructions, rendered once per (mode, count); None for an unknown mode"""
+    template = MODE_PROMPTS.get(mode)
+    if template is None:
+        return None
+    return template.format(count=count)
 
-        elif mode == 'SPOT_ERROR':
-            return f"""{base_info}
 
-Generate {count} questions with an intentional error that the student must identify.
-This tests critical thinking and deep understanding.
+@lru_cache(maxsize=16)
+def _all_modes_instructions(count: int) -> str:
+    """The concept-independent part of the all-modes prompt"""
+    sections = "\n\n".join(
+        f"## {mode}\n{_mode_instructions(mode, count).strip()}"
+        for mode in MODE_PROMPTS
+    )
+    return f"""Write questions about the concept described at the end, for each mode below.
 
-Return JSON array:
-[
-  {{
-    "question": "A student says: 'In a right triangle with sides 3 and 4, the hypotenuse is 5 because 3+4=7, and 7+5=12.' What's wrong with this reasoning?",
-    "answer": "The student added sides instead of using the Pythagorean theorem (a² + b² = c²). The correct calculation is 3² + 4² = 9 + 16 = 25 = 5².",
-    "difficulty": 7,
-    "data": {{"type": "error_detection", "error_type": "wrong_operation"}}
-  }}
-]
-"""
+{sections}
 
-        elif mode == 'BUILD_MAP':
-            return f"""{base_info}
-
-Generate {count} questions asking student to show relationships between this concept and related concepts.
-Tests ability to see the bigger picture.
-
-Return JSON array:
-[
-  {{
-    "question": "How does the Pythagorean theorem relate to: (a) distance formula, (b) trigonometry, (c) circles?",
-    "answer": "Model answer showing connections",
-    "difficulty": 8,
-    "data": {{"type": "relationships", "related": ["distance formula", "trigonometry", "circles"]}}
-  }}
-]
+Return a single JSON object whose keys are the mode names ({', '.join(MODE_PROMPTS)}),
+each mapping to that mode's JSON array as described above.
 """
 
-        return ""
-
-    def _chunk_text(self, text: str, max_tokens: int = 6000) -> List[str]:
-        """Split text into chunks that fit within token limit"""
-        # Rough estimate: 1 token ≈ 4 characters
-        max_chars = max_tokens * 4
-
-        if len(text) <= max_chars:
-            return [text]
-
-        chunks = []
-        current_chunk = ""
-
-        # Split by paragraphs
-        paragraphs = text.split('\n\n')
-
-        for para in paragraphs:
-            if len(current_chunk) + len(para) <= max_chars:
-                current_chunk += para + '\n\n'
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = para + '\n\n'
-
-        if current_chunk:
-            chunks.append(current_chunk)
 
-        return chunks
+@lru_cache(maxsize=None)
+def _get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """Tokenizer for a model, or None if it can't be loaded (chunking then estimates)"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        logger.warning("No tokenizer for %s, estimating chunk sizes: %r", model, e)
+        return None
+
+
+def _iter_chunks(text: str, max_tokens: int = 6000,
+                 encoding: Optional[tiktoken.Encoding] = None) -> Iterator[str]:
+    """Yield chunks of text that fit within token limit"""
+    if encoding is not None:
+        yield from _iter_token_chunks(text, max_tokens, encoding)
+        return
+
+    # Rough estimate: 1 token ≈ 4 characters
+    max_chars = max_tokens * 4
+
+    if len(text) <= max_chars:
+        yield text
+        return
+
+    # Collect paragraphs and join once per chunk; track the length as we go
+    parts = []
+    used = 0
+
+    # Split by paragraphs
+    for para in _iter_split(text, '\n\n'):
+        if used + len(para) > max_chars and parts:
+            yield '\n\n'.join(parts) + '\n\n'
+            parts = []
+            used = 0
+        parts.append(para)
+        used += len(para) + 2
+
+    if parts:
+        yield '\n\n'.join(parts) + '\n\n'
+
+
+def _iter_token_chunks(text: str, max_tokens: int, encoding: tiktoken.Encoding) -> Iterator[str]:
+    """Pack paragraphs into chunks by exact token count, overlapping consecutive chunks"""
+    parts = []
+    used = 0
+
+    for para in _iter_split(text, '\n\n'):
+        para_tokens = len(encoding.encode_ordinary(para)) + 1  # +1 for the paragraph break
+        if parts and used + para_tokens > max_tokens:
+            yield '\n\n'.join(parts)
+            # Start the next chunk with the end of the previous paragraph
+            tail = encoding.encode_ordinary(parts[-1])[-CHUNK_OVERLAP_TOKENS:]
+            parts = [encoding.decode(tail)]
+            used = len(tail)
+
+        parts.append(para)
+        used += para_tokens
+
+    if parts:
+        yield '\n\n'.join(parts)
@@ -7,19 +7,27 @@ Implements:
 3. Anxiety detection and rescue
 4. Real-time question selection and feedback
 """
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy import insert, text, update
+from collections import defaultdict, deque
 import uuid
 from datetime import datetime, timedelta
+import heapq
+import logging
 import random
 import math
+from operator import attrgetter, itemgetter
+from functools import lru_cache
 
 from models import (
     Concept, Question, UserConceptState, Response,
     Session as SessionModel, User
 )
 
+logger = logging.getLogger(__name__)
+
 
 class EngagementEngine:
     """Core engine that drives adaptive learning"""
@@ -47,6 +55,22 @@ class EngagementEngine:
         'MICRO_WINS': {'priority': 0, 'category': 'rescue'}  # Rescue mode
     }
 
+    # Responses are written in batches of this many rows (and when the session ends)
+    RESPONSE_BATCH_SIZE = 5
+
+    # Buffered responses are also written once this long has passed since the last
+    # write, so a slow session still saves them regularly
+    RESPONSE_FLUSH_INTERVAL = timedelta(seconds=60)
+
+    # Mode for each concept state (see _select_mode); learning and proficient
+    # concepts rotate through their modes by attempt count
+    STATE_MODES = {
+        'untouched': 'GUIDED_SOLVE',
+        'struggling': 'COLLABORATIVE',
+    }
+    LEARNING_MODES = ('RAPID_FIRE', 'FILL_STORY', 'NUMBER_SWAP')
+    PROFICIENT_MODES = ('EXPLAIN_BACK', 'SPOT_ERROR')
+
     # Mastery criteria thresholds
     MASTERY_THRESHOLDS = {
         'accuracy': 0.99,
@@ -63,21 +87,20 @@ class EngagementEngine:
         self.db = db
 
         # Load concepts for this material
-        print(f"=" * 60)
-        print(f"ENGAGEMENT ENGINE INIT for material_id: {self.material_id}")
         self.concepts = self.db.query(Concept).filter(
             Concept.material_id == self.material_id
         ).all()
         self.total_concepts = len(self.concepts)
-        print(f"Loaded {self.total_concepts} concepts from database")
+        self.concepts_by_id = {concept.id: concept for concept in self.concepts}
         if self.total_concepts > 0:
-            for i, concept in enumerate(self.concepts[:5], 1):
-                print(f"  [{i}] {concept.name[:60]}")
-            if self.total_concepts > 5:
-                print(f"  ... and {self.total_concepts - 5} more")
+            logger.info("Engagement engine for material_id %s: %d concepts", self.material_id, self.total_concepts)
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, concept in enumerate(self.concepts[:5], 1):
+                    logger.debug("  [%d] %.60s", i, concept.name)
+                if self.total_concepts > 5:
+                    logger.debug("  ... and %d more", self.total_concepts - 5)
         else:
-            print("WARNING: No concepts found in database!")
-        print(f"=" * 60)
+            logger.warning("No concepts found in database for material_id %s", self.material_id)
 
         # Current state
         self.current_concept: Optional[Concept] = None
@@ -85,19 +108,58 @@ class EngagementEngine:
         self.sequence_number = 0
 
         # Track asked questions to avoid repeats
-        self.asked_question_ids = set()
+        # (per concept, so resetting a concept doesn't touch the others)
+        self.asked_by_concept: Dict[uuid.UUID, set] = defaultdict(set)
 
         # Track consecutive questions on same concept (prevent getting stuck)
         self.consecutive_same_concept = 0
         self.last_concept_id = None
         self.MAX_CONSECUTIVE_PER_CONCEPT = 10  # Force concept change after this many questions
 
+        # Clock reading for the current turn, taken once by each entry point and
+        # shared by the helpers it calls
+        self.turn_time = datetime.now()
+
+        # Response rows not yet written to the database (see _record_response)
+        self.pending_responses: List[Dict] = []
+        self.last_flush_time = self.turn_time
+
+        # (time, concept_id, skipped) for this session's responses, oldest first;
+        # rescue detection only looks at the last few minutes of these
+        self.recent_responses: deque = deque()
+
+        # Times of correct answers per concept (for predicted recall), as hours since
+        # the epoch; loaded from the database once per concept, then kept up to date
+        self.correct_response_hours: Dict[uuid.UUID, List[float]] = {}
+
+        # All questions for these concepts, indexed by concept and by (concept, mode),
+        # so picking a question is a dict lookup instead of a query per turn
+        self.questions_by_concept: Dict[uuid.UUID, List[Question]] = defaultdict(list)
+        self.questions_by_concept_mode: Dict[Tuple[uuid.UUID, str], List[Question]] = defaultdict(list)
+        for question in self.db.query(Question).filter(
+            Question.concept_id.in_(self.concepts_by_id)
+        ).all():
+            self.questions_by_concept[question.concept_id].append(question)
+            self.questions_by_concept_mode[(question.concept_id, question.mode)].append(question)
+
+        # The user's state for every concept in this material, loaded once and then
+        # updated in place (new states are added as they are created). The caller
+        # should give the engine a session with expire_on_commit off, so these rows
+        # aren't re-SELECTed after every answer.
+        self.concept_states: Dict[uuid.UUID, UserConceptState] = {
+            cs.concept_id: cs
+            for cs in self.db.query(UserConceptState).filter(
+                UserConceptState.user_id == self.user_id,
+                UserConceptState.concept_id.in_(self.concepts_by_id)
+            ).all()
+        }
+
         # Session stats
         self.session = self.db.query(SessionModel).filter(
             SessionModel.id == self.session_id
         ).first()
 
-    async def get_next_question(self) -> Dict:
+    def get_next_question(self) -> Dict:
         """
         Main algorithm: Select next concept and mode
 
@@ -111,40 +173,42 @@ class EngagementEngine:
         if not self.concepts:
             return None  # No concepts extracted from material
 
+        self.turn_time = datetime.now()
+
         # Check if stuck on same concept for too long - force concept change
         force_concept_change = False
         if self.last_concept_id and self.consecutive_same_concept >= self.MAX_CONSECUTIVE_PER_CONCEPT:
             force_concept_change = True
-            print(f"FORCE CONCEPT CHANGE: Stuck on concept for {self.consecutive_same_concept} questions")
+            logger.debug("Forcing concept change: stuck on concept for %d questions", self.consecutive_same_concept)
 
         # Step 1: Check for concepts needing rescue (unless forcing concept change)
         if not force_concept_change:
-            rescue_concept = await self._find_rescue_concept()
+            rescue_concept = self._find_rescue_concept()
             if rescue_concept:
                 self.current_concept = rescue_concept
                 self.current_mode = 'MICRO_WINS'
-                return await self._build_question()
+                return self._build_question()
 
         # Step 2: Check for concepts ready for mastery validation
-        validation_concept = await self._find_validation_concept()
+        validation_concept = self._find_validation_concept()
         if validation_concept:
             self.current_concept = validation_concept
             self.current_mode = 'MASTERY_VALIDATION'
-            return await self._build_question()
+            return self._build_question()
 
         # Step 3: Select concept at optimal challenge level
         # If forcing change, exclude current concept
-        self.current_concept = await self._select_optimal_concept(
+        self.current_concept = self._select_optimal_concept(
             exclude_concept_id=self.last_concept_id if force_concept_change else None
         )
 
         # Step 4: Select appropriate mode for this concept
-        self.current_mode = await self._select_mode()
+        self.current_mode = self._select_mode()
 
         # Build and return question
-        return await self._build_question()
+        return self._build_question()
 
-    async def process_answer(self, answer: str, response_time_ms: int, hesitation_ms: int) -> Dict:
+    def process_answer(self, answer: str, response_time_ms: int, hesitation_ms: int) -> Dict:
         """
         Process student answer and update state
 
@@ -161,22 +225,16 @@ class EngagementEngine:
             'stats': dict
         }
         """
-        # Get question - try for specific mode first, then fallback
-        question = self.db.query(Question).filter(
-            Question.concept_id == self.current_concept.id,
-            Question.mode == self.current_mode
-        ).first()
+        self.turn_time = datetime.now()
 
-        if not question:
-            # Fallback to any question for this concept
-            print(f"WARNING: No question found for mode '{self.current_mode}', using any available question")
-            question = self.db.query(Question).filter(
-                Question.concept_id == self.current_concept.id
-            ).first()
+        # Get question - try for specific mode first, then fallback
+        question = self._get_current_question()
+        if question and question.mode != self.current_mode:
+            logger.warning("No question found for mode '%s', using any available question", self.current_mode)
 
         if not question:
             # This shouldn't happen, but handle gracefully
-            print(f"CRITICAL: No questions found for concept {self.current_concept.id}")
+            logger.error("No questions found for concept %s", self.current_concept.id)
             return {
                 'correct': False,
                 'explanation': "System error: Unable to verify answer. Please continue.",
@@ -187,31 +245,25 @@ class EngagementEngine:
             }
 
         # Evaluate answer
-        is_correct, is_partial = await self._evaluate_answer(answer, question)
+        is_correct, is_partial = self._evaluate_answer(answer, question)
 
         # Record response
-        response = Response(
-            user_id=self.user_id,
-            concept_id=self.current_concept.id,
+        self._record_response(
             question_id=question.id,
-            session_id=self.session_id,
-            mode=self.current_mode,
             user_answer=answer,
             is_correct=is_correct,
             is_partial=is_partial,
             response_time_ms=response_time_ms,
             time_to_first_keystroke_ms=hesitation_ms,
-            difficulty_at_time=question.difficulty,
-            sequence_number=self.sequence_number
+            difficulty_at_time=question.difficulty
         )
-        self.db.add(response)
 
         # Update concept state
         concept_state = self._get_or_create_concept_state(self.current_concept.id)
-        await self._update_concept_state(concept_state, is_correct, response_time_ms, hesitation_ms)
+        self._update_concept_state(concept_state, is_correct, response_time_ms, hesitation_ms)
 
         # Check mastery
-        mastered = await self._check_mastery(concept_state)
+        mastered = self._check_mastery(concept_state)
 
         # Update session stats
         self.session.total_questions += 1
@@ -220,10 +272,10 @@ class EngagementEngine:
         if mastered:
             self.session.concepts_mastered_this_session += 1
 
-        self.db.commit()
+        self._commit_turn()
 
         # Check session completion
-        session_complete = await self._check_session_complete()
+        session_complete = self._check_session_complete()
 
         result = {
             'correct': is_correct,
@@ -235,33 +287,29 @@ class EngagementEngine:
         }
 
         if session_complete:
-            result['stats'] = await self._get_session_stats()
+            result['stats'] = self._get_session_stats()
 
         self.sequence_number += 1
 
         return result
 
-    async def process_skip(self) -> Dict:
+    def process_skip(self) -> Dict:
         """Handle skip action - indicates anxiety or confusion"""
-        response = Response(
-            user_id=self.user_id,
-            concept_id=self.current_concept.id,
+        self.turn_time = datetime.now()
+        self._record_response(
             question_id=None,
-            session_id=self.session_id,
-            mode=self.current_mode,
             is_correct=False,
             skipped=True,
-            response_time_ms=0,
-            sequence_number=self.sequence_number
+            response_time_ms=0
         )
-        self.db.add(response)
 
         # Update concept state - mark as struggling
         concept_state = self._get_or_create_concept_state(self.current_concept.id)
         concept_state.state = 'struggling'
         concept_state.hesitation_count += 1
+        self._touch_concept_state(concept_state)
 
-        self.db.commit()
+        self._commit_turn()
         self.sequence_number += 1
 
         return {
@@ -269,18 +317,10 @@ class EngagementEngine:
             'message': 'No problem! Let\'s try something else.'
         }
 
-    async def process_peek(self) -> Dict:
+    def process_peek(self) -> Dict:
         """Handle peek action - show answer"""
-        question = self.db.query(Question).filter(
-            Question.concept_id == self.current_concept.id,
-            Question.mode == self.current_mode
-        ).first()
-
-        if not question:
-            # Fallback to any question for this concept
-            question = self.db.query(Question).filter(
-                Question.concept_id == self.current_concept.id
-            ).first()
+        self.turn_time = datetime.now()
+        question = self._get_current_question()
 
         if not question:
             return {
@@ -289,19 +329,13 @@ class EngagementEngine:
                 'explanation': 'Here is the concept definition.'
             }
 
-        response = Response(
-            user_id=self.user_id,
-            concept_id=self.current_concept.id,
+        self._record_response(
             question_id=question.id,
-            session_id=self.session_id,
-            mode=self.current_mode,
             is_correct=False,
             peeked=True,
-            response_time_ms=0,
-            sequence_number=self.sequence_number
+            response_time_ms=0
         )
-        self.db.add(response)
-        self.db.commit()
+        self._commit_turn()
         self.sequence_number += 1
 
         return {
@@ -310,18 +344,9 @@ class EngagementEngine:
             'explanation': 'Take your time to understand this. We\'ll test it again later.'
         }
 
-    async def get_hint(self) -> Dict:
+    def get_hint(self) -> Dict:
         """Provide hint for current question"""
-        question = self.db.query(Question).filter(
-            Question.concept_id == self.current_concept.id,
-            Question.mode == self.current_mode
-        ).first()
-
-        if not question:
-            # Fallback to any question for this concept
-            question = self.db.query(Question).filter(
-                Question.concept_id == self.current_concept.id
-            ).first()
+        question = self._get_current_question()
 
         if not question:
             return {
@@ -337,64 +362,125 @@ class EngagementEngine:
             'hint': hint
         }
 
-    async def save_session_state(self):
+    def save_session_state(self):
         """Save session when disconnected"""
+        self._flush_responses()
         if self.session:
             self.session.end_time = datetime.now()
             duration = (self.session.end_time - self.session.start_time).total_seconds() / 60
             self.session.duration_minutes = int(duration)
-            self.db.commit()
+        self.db.commit()
 
     # ===== INTERNAL METHODS =====
 
-    async def _find_rescue_concept(self) -> Optional[Concept]:
+    def _record_response(self, question_id: Optional[uuid.UUID], is_correct: bool, response_time_ms: int,
+                         user_answer: Optional[str] = None, is_partial: bool = False,
+                         time_to_first_keystroke_ms: Optional[int] = None, difficulty_at_time: Optional[int] = None,
+                         skipped: bool = False, peeked: bool = False):
+        """
+        Record a response to the current question
+
+        Rows are buffered and written with one multi-row INSERT once RESPONSE_BATCH_SIZE
+        have built up (see _commit_turn). Every row carries the same keys, and
+        created_at is the turn time: the row may be written minutes later, and
+        predicted recall reads these times back alongside turn_time.
+        """
+        now = self.turn_time
+        self.pending_responses.append({
+            'user_id': self.user_id,
+            'concept_id': self.current_concept.id,
+            'question_id': question_id,
+            'session_id': self.session_id,
+            'mode': self.current_mode,
+            'user_answer': user_answer,
+            'is_correct': is_correct,
+            'is_partial': is_partial,
+            'response_time_ms': response_time_ms,
+            'time_to_first_keystroke_ms': time_to_first_keystroke_ms,
+            'difficulty_at_time': difficulty_at_time,
+            'sequence_number': self.sequence_number,
+            'skipped': skipped,
+            'peeked': peeked,
+            'created_at': now
+        })
+        self.recent_responses.append((now, self.current_concept.id, skipped))
+
+    def _commit_turn(self):
+        """
+        Commit the turn, writing buffered responses once a batch has built up
+        or RESPONSE_FLUSH_INTERVAL has passed
+
+        Every turn is committed, so no transaction (or row lock) is held while
+        waiting for the next message. On Postgres, turns that write no responses
+        commit without waiting for the WAL flush: a crash can lose the last few
+        of them, but save_session_state and each response batch commit normally.
+        """
+        if (len(self.pending_responses) >= self.RESPONSE_BATCH_SIZE
+                or self.turn_time - self.last_flush_time >= self.RESPONSE_FLUSH_INTERVAL):
+            self._flush_responses()
+            self.last_flush_time = self.turn_time
+        elif self.db.get_bind().dialect.name == 'postgresql':
+            self.db.execute(text("SET LOCAL synchronous_commit TO OFF"))
+        self.db.commit()
+
+    def _flush_responses(self):
+        """Write buffered response rows (committed by the caller)"""
+        if self.pending_responses:
+            self.db.execute(insert(Response), self.pending_responses)
+            self.pending_responses = []
+
+    def _find_rescue_concept(self) -> Optional[Concept]:
         """Find concept where student is struggling (needs rescue mode)"""
         # Look for concepts with high skip rate or long hesitation
-        recent_responses = self.db.query(Response).filter(
-            Response.session_id == self.session_id,
-            Response.created_at >= datetime.now() - timedelta(minutes=5)
-        ).all()
+        recent_responses = self.recent_responses
+        cutoff = self.turn_time - timedelta(minutes=5)
+        while recent_responses and recent_responses[0][0] < cutoff:
+            recent_responses.popleft()
 
         if not recent_responses:
             return None
 
         # Calculate skip ratio and hesitation ratio
-        skip_count = sum(1 for r in recent_responses if r.skipped)
+        skip_count = sum(1 for _, _, skipped in recent_responses if skipped)
         skip_ratio = skip_count / len(recent_responses) if recent_responses else 0
 
         # If skip ratio > 30%, enter rescue mode
         if skip_ratio > 0.3:
             # Find concept with most skips
             concept_skips = {}
-            for r in recent_responses:
-                if r.skipped:
-                    concept_skips[r.concept_id] = concept_skips.get(r.concept_id, 0) + 1
+            for _, concept_id, skipped in recent_responses:
+                if skipped:
+                    concept_skips[concept_id] = concept_skips.get(concept_id, 0) + 1
 
             if concept_skips:
                 struggling_concept_id = max(concept_skips, key=concept_skips.get)
-                return self.db.query(Concept).filter(Concept.id == struggling_concept_id).first()
+                return self.concepts_by_id.get(struggling_concept_id)
 
         return None
 
-    async def _find_validation_concept(self) -> Optional[Concept]:
+    def _find_validation_concept(self) -> Optional[Concept]:
         """Find concept ready for mastery validation"""
         # Look for concepts that meet criteria 1-4 but not yet validated
-        concept_states = self.db.query(UserConceptState).filter(
-            UserConceptState.user_id == self.user_id,
-            UserConceptState.concept_id.in_([c.id for c in self.concepts]),
-            UserConceptState.state == 'learning',
-            UserConceptState.accuracy >= self.MASTERY_THRESHOLDS['accuracy'],
-            UserConceptState.consecutive_perfect >= self.MASTERY_THRESHOLDS['consecutive_perfect']
-        ).all()
+        min_accuracy = self.MASTERY_THRESHOLDS['accuracy']
+        min_streak = self.MASTERY_THRESHOLDS['consecutive_perfect']
+        # Validate the one with the longest perfect streak first
+        state = max(
+            (
+                cs for cs in self.concept_states.values()
+                if cs.state == 'learning'
+                and cs.accuracy >= min_accuracy
+                and cs.consecutive_perfect >= min_streak
+            ),
+            key=attrgetter('consecutive_perfect'),
+            default=None
+        )
 
-        if concept_states:
-            # Pick one at random
-            state = random.choice(concept_states)
-            return self.db.query(Concept).filter(Concept.id == state.concept_id).first()
+        if state:
+            return self.concepts_by_id[state.concept_id]
 
         return None
 
-    async def _select_optimal_concept(self, exclude_concept_id: Optional[uuid.UUID] = None) -> Concept:
+    def _select_optimal_concept(self, exclude_concept_id: Optional[uuid.UUID] = None) -> Concept:
         """
         Select concept at optimal difficulty level
 
@@ -404,14 +490,8 @@ class EngagementEngine:
         - Avoid mastered concepts unless review needed
         - Optionally exclude a specific concept (to force variety)
         """
-        # Get all concept states
-        concept_states = {
-            cs.concept_id: cs
-            for cs in self.db.query(UserConceptState).filter(
-                UserConceptState.user_id == self.user_id,
-                UserConceptState.concept_id.in_([c.id for c in self.concepts])
-            ).all()
-        }
+        concept_states = self.concept_states
+        now = self.turn_time
 
         # Score each concept
         scores = []
@@ -424,7 +504,7 @@ class EngagementEngine:
 
             if state and state.state == 'mastered':
                 # Check if review needed
-                if state.next_review_at and state.next_review_at <= datetime.now():
+                if state.next_review_at and state.next_review_at <= now:
                     scores.append((concept, 50))  # Medium priority for review
                 else:
                     continue  # Skip mastered concepts not due for review
@@ -434,7 +514,7 @@ class EngagementEngine:
 
             elif state and state.state == 'learning':
                 # Medium priority, adjusted by time since last seen
-                time_since = (datetime.now() - state.updated_at).total_seconds() / 60
+                time_since = (now - state.updated_at).total_seconds() / 60
                 score = 60 + min(time_since, 30)  # Cap at 90
                 scores.append((concept, score))
 
@@ -454,14 +534,12 @@ class EngagementEngine:
                 return self.concepts[0]  # Return any
             return None  # No concepts available
 
-        # Select weighted random
-        scores.sort(key=lambda x: x[1], reverse=True)
-
-        # Take top 5 and choose randomly
-        top_concepts = scores[:5]
+        # Take top 5 and choose randomly (nlargest keeps the order a stable
+        # descending sort would give, without sorting every concept)
+        top_concepts = heapq.nlargest(5, scores, key=itemgetter(1))
         return random.choice(top_concepts)[0]
 
-    async def _select_mode(self) -> str:
+    def _select_mode(self) -> str:
         """
         Select appropriate mode based on concept state
 
@@ -474,87 +552,57 @@ class EngagementEngine:
         """
         state = self._get_or_create_concept_state(self.current_concept.id)
 
-        if state.state == 'untouched':
-            return 'GUIDED_SOLVE'
-
-        elif state.state == 'struggling':
-            return 'COLLABORATIVE'
+        mode = self.STATE_MODES.get(state.state)
+        if mode:
+            return mode
 
-        elif state.state == 'learning':
+        if state.state == 'learning':
             # Rotate through active modes
-            if state.total_attempts % 3 == 0:
-                return 'RAPID_FIRE'
-            elif state.total_attempts % 3 == 1:
-                return 'FILL_STORY'
-            else:
-                return 'NUMBER_SWAP'
+            return self.LEARNING_MODES[state.total_attempts % 3]
 
-        elif state.state == 'proficient':
+        if state.state == 'proficient':
             # Alternate deep modes
-            if state.total_attempts % 2 == 0:
-                return 'EXPLAIN_BACK'
-            else:
-                return 'SPOT_ERROR'
+            return self.PROFICIENT_MODES[state.total_attempts % 2]
 
-        else:  # mastered
-            return 'BUILD_MAP'
+        return 'BUILD_MAP'  # mastered
 
-    async def _build_question(self) -> Dict:
+    def _build_question(self) -> Dict:
         """Build question data to send to client"""
         # Get random question for this concept+mode, excluding already asked
-        question_query = self.db.query(Question).filter(
-            Question.concept_id == self.current_concept.id,
-            Question.mode == self.current_mode
-        )
-
-        # Exclude already asked questions
-        if self.asked_question_ids:
-            question_query = question_query.filter(
-                ~Question.id.in_(self.asked_question_ids)
-            )
-
-        question = question_query.order_by(func.random()).first()
+        asked = self.asked_by_concept[self.current_concept.id]
+        mode_questions = self.questions_by_concept_mode.get((self.current_concept.id, self.current_mode), [])
+        candidates = [q for q in mode_questions if q.id not in asked]
+        question = random.choice(candidates) if candidates else None
 
         # If no new questions available for this mode, try fallback
         if not question:
             # Check if we've exhausted all questions for this concept+mode
-            total_for_mode = self.db.query(Question).filter(
-                Question.concept_id == self.current_concept.id,
-                Question.mode == self.current_mode
-            ).count()
-
-            if total_for_mode > 0:
+            if mode_questions:
                 # We've asked all questions for this mode - reset tracking for this concept
-                print(f"All questions asked for {self.current_concept.name} in {self.current_mode} mode. Resetting...")
+                logger.debug("All questions asked for %s in %s mode. Resetting...", self.current_concept.name, self.current_mode)
                 # Remove this concept's questions from tracking
-                concept_question_ids = {
-                    q.id for q in self.db.query(Question).filter(
-                        Question.concept_id == self.current_concept.id
-                    ).all()
-                }
-                self.asked_question_ids -= concept_question_ids
+                asked.clear()
 
                 # Try again
-                question = self.db.query(Question).filter(
-                    Question.concept_id == self.current_concept.id,
-                    Question.mode == self.current_mode
-                ).order_by(func.random()).first()
+                question = random.choice(mode_questions)
 
             # If still no question, try any mode for this concept
             if not question:
-                print(f"WARNING: No question found for mode '{self.current_mode}', falling back to any question for concept {self.current_concept.id}")
-                question = self.db.query(Question).filter(
-                    Question.concept_id == self.current_concept.id,
-                    ~Question.id.in_(self.asked_question_ids) if self.asked_question_ids else True
-                ).order_by(func.random()).first()
+                logger.warning("No question found for mode '%s', falling back to any question for concept %s",
+                               self.current_mode, self.current_concept.id)
+                candidates = [
+                    q for q in self.questions_by_concept.get(self.current_concept.id, [])
+                    if q.id not in asked
+                ]
+                question = random.choice(candidates) if candidates else None
 
         if not question:
             # No questions at all for this concept - critical error
-            print(f"CRITICAL ERROR: No questions found for concept {self.current_concept.id} - {self.current_concept.name}")
+            logger.error("No questions found for concept %s - %s", self.current_concept.id, self.current_concept.name)
             return None
 
         # Track this question as asked
-        self.asked_question_ids.add(question.id)
+        asked.add(question.id)
 
         # Track consecutive questions on same concept
         if self.last_concept_id == self.current_concept.id:
@@ -564,7 +612,8 @@ class EngagementEngine:
             self.consecutive_same_concept = 1
             self.last_concept_id = self.current_concept.id
 
-        print(f"Selected question ID {question.id} (Total asked: {len(self.asked_question_ids)}, Consecutive on '{self.current_concept.name}': {self.consecutive_same_concept})")
+        logger.debug("Selected question ID %s (Asked for concept: %d, Consecutive on '%s': %d)",
+                     question.id, len(asked), self.current_concept.name, self.consecutive_same_concept)
 
         # Use the question's actual mode if we fell back
         actual_mode = question.mode
@@ -578,9 +627,9 @@ class EngagementEngine:
             'data': question.question_data or {}
         }
 
-    async def _evaluate_answer(self, user_answer: str, question: Question) -> tuple:
+    def _evaluate_answer(self, user_answer: str, question: Question) -> tuple:
         """Evaluate if answer is correct"""
-        correct_answer = question.answer_text.lower().strip()
+        correct_answer = _normalise_answer(question.answer_text)
         user_answer = user_answer.lower().strip()
 
         # Exact match
@@ -597,22 +646,36 @@ class EngagementEngine:
         else:
             return (False, False)
 
+    def _get_current_question(self) -> Optional[Question]:
+        """The question answers are checked against: first for the current mode, else for the concept"""
+        questions = self.questions_by_concept_mode.get((self.current_concept.id, self.current_mode))
+        if questions:
+            return questions[0]
+
+        # Fallback to any question for this concept
+        questions = self.questions_by_concept.get(self.current_concept.id)
+        return questions[0] if questions else None
+
     def _calculate_similarity(self, s1: str, s2: str) -> float:
         """Calculate string similarity (0-1)"""
-        # Simple word overlap
+        # Simple word overlap (s2 is the correct answer, whose words are cached)
         words1 = set(s1.split())
-        words2 = set(s2.split())
+        words2 = _answer_words(s2)
 
         if not words1 or not words2:
             return 0.0
 
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
+        # |A ∪ B| = |A| + |B| - |A ∩ B|, so the union set is never built
+        intersection = len(words1 & words2)
 
-        return len(intersection) / len(union)
+        return intersection / (len(words1) + len(words2) - intersection)
 
     def _get_or_create_concept_state(self, concept_id: uuid.UUID) -> UserConceptState:
         """Get or create concept state for user"""
+        state = self.concept_states.get(concept_id)
+        if state:
+            return state
+
         state = self.db.query(UserConceptState).filter(
             UserConceptState.user_id == self.user_id,
             UserConceptState.concept_id == concept_id
@@ -625,12 +688,25 @@ class EngagementEngine:
                 state='untouched'
             )
             self.db.add(state)
-            self.db.commit()
+            self.db.flush()  # apply column defaults; committed with the next answer
 
+        self.concept_states[concept_id] = state
         return state
 
-    async def _update_concept_state(self, state: UserConceptState, is_correct: bool,
-                                   response_time_ms: int, hesitation_ms: int):
+    def _touch_concept_state(self, state: UserConceptState):
+        """
+        Stamp updated_at with this turn's time
+
+        Concept selection compares updated_at with turn_time, so it is set from
+        the same clock rather than by the column's onupdate (the database clock).
+        flag_modified keeps the value in the UPDATE even when it equals the one
+        loaded at insert.
+        """
+        state.updated_at = self.turn_time
+        flag_modified(state, 'updated_at')
+
+    def _update_concept_state(self, state: UserConceptState, is_correct: bool,
+                              response_time_ms: int, hesitation_ms: int):
         """Update all tracking metrics"""
         # Criterion 1: Accuracy
         state.total_attempts += 1
@@ -664,8 +740,11 @@ class EngagementEngine:
                 state.formats_passed = state.formats_passed + [self.current_mode]
 
         # Criterion 5: Predicted Recall
-        state.last_tested_at = datetime.now()
+        state.last_tested_at = self.turn_time
+        self._touch_concept_state(state)
         state.predicted_recall_probability = self._calculate_predicted_recall(state)
+        if is_correct:
+            self._get_correct_response_hours(state.concept_id).append(_hours(state.last_tested_at))
 
         # Update state category
         if state.accuracy < 0.5:
@@ -677,8 +756,6 @@ class EngagementEngine:
         else:
             state.state = 'struggling'
 
-        self.db.commit()
-
     def _calculate_predicted_recall(self, state: UserConceptState) -> float:
         """
         Calculate predicted recall probability using ACT-R memory decay
@@ -690,24 +767,15 @@ class EngagementEngine:
             return 0.0
 
         # Get all correct responses for this concept
-        responses = self.db.query(Response).filter(
-            Response.user_id == self.user_id,
-            Response.concept_id == state.concept_id,
-            Response.is_correct == True
-        ).order_by(Response.created_at).all()
+        correct_hours = self._get_correct_response_hours(state.concept_id)
 
-        if not responses:
+        if not correct_hours:
             return 0.0
 
-        # Calculate activation
+        # Calculate activation over plain floats (hours since each correct answer)
         decay_rate = 0.5  # d parameter
-        now = datetime.now()
-        activation_sum = 0
-
-        for response in responses:
-            time_since = (now - response.created_at).total_seconds() / 3600  # hours
-            if time_since > 0:
-                activation_sum += time_since ** (-decay_rate)
+        now = _hours(self.turn_time)
+        activation_sum = sum((now - hours) ** (-decay_rate) for hours in correct_hours if hours < now)
 
         if activation_sum == 0:
             return 0.0
@@ -719,60 +787,73 @@ class EngagementEngine:
 
         return probability
 
-    async def _check_mastery(self, state: UserConceptState) -> bool:
+    def _get_correct_response_hours(self, concept_id: uuid.UUID) -> List[float]:
+        """Times of the user's correct answers for a concept (queried once, then cached)"""
+        times = self.correct_response_hours.get(concept_id)
+        if times is None:
+            times = [
+                _hours(created_at) for (created_at,) in self.db.query(Response.created_at).filter(
+                    Response.user_id == self.user_id,
+                    Response.concept_id == concept_id,
+                    Response.is_correct == True
+                ).order_by(Response.created_at).all()
+            ]
+            self.correct_response_hours[concept_id] = times
+        return times
+
+    def _check_mastery(self, state: UserConceptState) -> bool:
         """Check if concept meets all 5 mastery criteria"""
         if state.state == 'mastered':
             return False  # Already mastered
 
+        thresholds = self.MASTERY_THRESHOLDS
+
         # Criterion 1: Accuracy >= 99%
-        if state.accuracy < self.MASTERY_THRESHOLDS['accuracy']:
+        if state.accuracy < thresholds['accuracy']:
             return False
 
         # Criterion 2: 10 consecutive perfect
-        if state.consecutive_perfect < self.MASTERY_THRESHOLDS['consecutive_perfect']:
+        if state.consecutive_perfect < thresholds['consecutive_perfect']:
             return False
 
         # Criterion 3: Speed/Fluency
         if state.baseline_response_time_ms and state.avg_response_time_ms:
             speed_ratio = state.avg_response_time_ms / state.baseline_response_time_ms
-            if speed_ratio > self.MASTERY_THRESHOLDS['speed_ratio']:
+            if speed_ratio > thresholds['speed_ratio']:
                 return False
 
         # Criterion 4: Format Invariance
         if len(state.formats_tested) > 0:
             format_pass_rate = len(state.formats_passed) / len(state.formats_tested)
-            if format_pass_rate < self.MASTERY_THRESHOLDS['format_coverage']:
+            if format_pass_rate < thresholds['format_coverage']:
                 return False
 
         # Criterion 5: Predicted Recall >= 95%
-        if state.predicted_recall_probability < self.MASTERY_THRESHOLDS['predicted_recall']:
+        if state.predicted_recall_probability < thresholds['predicted_recall']:
             return False
 
         # ALL CRITERIA MET - MASTERY ACHIEVED
         state.state = 'mastered'
-        state.mastered_at = datetime.now()
-        state.next_review_at = datetime.now() + timedelta(days=7)
-
-        # Update user total
-        user = self.db.query(User).filter(User.id == self.user_id).first()
-        user.total_concepts_mastered += 1
-
-        self.db.commit()
+        state.mastered_at = self.turn_time
+        state.next_review_at = self.turn_time + timedelta(days=7)
+
+        # Update user total in SQL, so concurrent sessions don't lose increments
+        self.db.execute(
+            update(User)
+            .where(User.id == self.user_id)
+            .values(total_concepts_mastered=User.total_concepts_mastered + 1)
+        )
 
         return True
 
-    async def _check_session_complete(self) -> bool:
+    def _check_session_complete(self) -> bool:
         """Check if session goals met"""
         # Simple: All concepts mastered
-        mastered_count = self.db.query(UserConceptState).filter(
-            UserConceptState.user_id == self.user_id,
-            UserConceptState.concept_id.in_([c.id for c in self.concepts]),
-            UserConceptState.state == 'mastered'
-        ).count()
+        mastered_count = sum(1 for cs in self.concept_states.values() if cs.state == 'mastered')
 
         return mastered_count >= self.total_concepts
 
-    async def _get_session_stats(self) -> Dict:
+    def _get_session_stats(self) -> Dict:
         """Get session statistics"""
         return {
             'duration_minutes': self.session.duration_minutes,
@@ -797,3 +878,23 @@ class EngagementEngine:
             return answer[:20] + "..."
         else:
             return answer[0] + "_" * (len(answer) - 1)
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _hours(timestamp: datetime) -> float:
+    """Hours since the epoch (timestamps are naive local times, as stored)"""
+    return (timestamp - EPOCH).total_seconds() / 3600
+
+
+@lru_cache(maxsize=1024)
+def _normalise_answer(answer: str) -> str:
+    """Lower-cased, stripped correct answer (questions are graded repeatedly, so cache it)"""
+    return answer.lower().strip()
+
+
+@lru_cache(maxsize=1024)
+def _answer_words(answer: str) -> frozenset:
+    """Word set of a (normalised) correct answer; the same answers come up all session"""
+    return frozenset(answer.split())
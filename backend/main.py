@@ -1,19 +1,26 @@
 """
 Mastery Machine - Main FastAPI Application
 """
-from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect, Depends, HTTPException, Body
+from fastapi import FastAPI, BackgroundTasks, UploadFile, File, WebSocket, WebSocketDisconnect, Depends, HTTPException, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, func, insert, select
 from sqlalchemy.orm import sessionmaker, Session
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import anyio
 import os
+import shutil
+import hashlib
 from dotenv import load_dotenv
 import uuid
-from typing import Optional
+from typing import Annotated, Literal, Optional, Union
 import json
-from pydantic import BaseModel
+import orjson
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 
-from models import Base, User, Material, Session as SessionModel, Concept, Question, InversionParagraph, Gap, Patch, MasteryCheckpoint, UserMasteryProgress
+from models import Base, User, Material, Session as SessionModel, Concept, Question, UserConceptState, InversionParagraph, Gap, Patch, MasteryCheckpoint, UserMasteryProgress
 from pdf_processor import PDFProcessor
 from concept_extractor import ConceptExtractor
 from engagement_engine import EngagementEngine
@@ -28,20 +35,60 @@ class UserCreate(BaseModel):
     email: str
 
 
+# WebSocket messages from the client, told apart by their "type"
+class AnswerMessage(BaseModel):
+    type: Literal["answer"]
+    answer: str
+    response_time_ms: int
+    hesitation_ms: int = 0
+
+
+class SkipMessage(BaseModel):
+    type: Literal["skip"]
+
+
+class PeekMessage(BaseModel):
+    type: Literal["peek"]
+
+
+class HintMessage(BaseModel):
+    type: Literal["hint"]
+
+
+client_message = TypeAdapter(Annotated[
+    Union[AnswerMessage, SkipMessage, PeekMessage, HintMessage],
+    Field(discriminator="type")
+])
+
+
 # Database setup
+# The ORM session is synchronous, so endpoints that only touch the database
+# are plain `def`: FastAPI runs them in its threadpool instead of blocking
+# the event loop on every query
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/mastery_machine")
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,  # drop dead connections before use
+    # Sized for the threadpool endpoints plus open WebSocket sessions; keep
+    # pool_size + max_overflow (times workers) under Postgres max_connections
+    pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    pool_timeout=30,
+    pool_recycle=1800,  # recycle before server/proxy idle timeouts close them
+    insertmanyvalues_page_size=2000  # one multi-row INSERT per extractor batch (see concept_extractor)
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
-
 # Global instances
 pdf_processor = PDFProcessor()
 concept_extractor = ConceptExtractor()
 paragraph_inverter = ParagraphInverter()
 patch_scorer = PatchScorer()
-engagement_engines = {}  # Store active engagement engines by session_id
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+AI_CONCEPTS = os.getenv("AI_CONCEPTS") == "1"  # extract concepts with OpenAI instead of text patterns
+AI_QUESTIONS = os.getenv("AI_QUESTIONS") == "1"  # generate questions with OpenAI instead of templates
+WS_IDLE_TIMEOUT_SECONDS = 30 * 60  # long enough for a student to think, short enough to reap abandoned tabs
 
 
 def get_db():
@@ -53,10 +100,31 @@ def get_db():
         db.close()
 
 
+@contextmanager
+def no_expire_on_commit(db: Session):
+    """Keep loaded attributes across commits so objects aren't re-SELECTed"""
+    old = db.expire_on_commit
+    db.expire_on_commit = False
+    try:
+        yield db
+    finally:
+        db.expire_on_commit = old
+
+
+async def send_json(websocket: WebSocket, payload):
+    """Send a JSON text frame, encoded with orjson rather than the stdlib json"""
+    await websocket.send_text(orjson.dumps(payload).decode())
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager"""
     print("🚀 Mastery Machine starting up...")
+    # Create missing tables at startup rather than on import, so the module
+    # can be imported without a database; set AUTO_CREATE_TABLES=0 when the
+    # schema is managed separately (migrate_db.py)
+    if os.getenv("AUTO_CREATE_TABLES", "1") == "1":
+        Base.metadata.create_all(bind=engine)
     yield
     print("👋 Mastery Machine shutting down...")
 
@@ -65,7 +133,8 @@ app = FastAPI(
     title="Mastery Machine API",
     description="Active learning tool that guarantees mastery through adaptive engagement",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS - Allow frontend from localhost and Vercel
@@ -99,7 +168,7 @@ async def root():
 
 
 @app.post("/api/demo/create")
-async def create_demo_material(db: Session = Depends(get_db)):
+def create_demo_material(db: Session = Depends(get_db)):
     """Create demo material with sample concepts for testing"""
     # Get or create demo user
     user = db.query(User).filter(User.email == "demo@masterymachine.com").first()
@@ -121,6 +190,7 @@ async def create_demo_material(db: Session = Depends(get_db)):
         processing_status='ready'
     )
     db.add(material)
+    db.flush()  # the bulk inserts below reference the material row
 
     # Create sample concepts
     concepts_data = [
@@ -147,20 +217,22 @@ async def create_demo_material(db: Session = Depends(get_db)):
         }
     ]
 
+    # Build plain rows with client-side ids and insert them in two bulk statements
+    concept_rows = []
+    question_rows = []
     for concept_data in concepts_data:
-        concept = Concept(
-            material_id=material_id,
-            name=concept_data["name"],
-            type=concept_data["type"],
-            full_name=concept_data["full_name"],
-            definition=concept_data["definition"],
-            context="Python programming basics",
-            complexity=concept_data["complexity"],
-            domain="programming"
-        )
-        db.add(concept)
-        db.commit()
-        db.refresh(concept)
+        concept_id = uuid.uuid4()
+        concept_rows.append({
+            "id": concept_id,
+            "material_id": material_id,
+            "name": concept_data["name"],
+            "type": concept_data["type"],
+            "full_name": concept_data["full_name"],
+            "definition": concept_data["definition"],
+            "context": "Python programming basics",
+            "complexity": concept_data["complexity"],
+            "domain": "programming"
+        })
 
         # Add sample questions for each concept
         questions = [
@@ -177,15 +249,16 @@ async def create_demo_material(db: Session = Depends(get_db)):
         ]
 
         for q_data in questions:
-            question = Question(
-                concept_id=concept.id,
-                mode=q_data["mode"],
-                question_text=q_data["question"],
-                answer_text=q_data["answer"],
-                difficulty=concept_data["complexity"]
-            )
-            db.add(question)
+            question_rows.append({
+                "concept_id": concept_id,
+                "mode": q_data["mode"],
+                "question_text": q_data["question"],
+                "answer_text": q_data["answer"],
+                "difficulty": concept_data["complexity"]
+            })
 
+    db.execute(insert(Concept), concept_rows)
+    db.execute(insert(Question), question_rows)
     db.commit()
 
     return {
@@ -198,7 +271,7 @@ async def create_demo_material(db: Session = Depends(get_db)):
 
 
 @app.post("/api/users")
-async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
+def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
     """Create or get user"""
     user = db.query(User).filter(User.email == user_data.email).first()
     if not user:
@@ -216,7 +289,8 @@ async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
 
 
 @app.post("/api/upload")
-async def upload_material(
+def upload_material(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user_id: str = None,
     db: Session = Depends(get_db)
@@ -250,9 +324,9 @@ async def upload_material(
 
     file_path = os.path.join(upload_dir, f"{material_id}.pdf")
 
+    # Stream to disk in 1 MiB chunks rather than reading the whole upload into memory
     with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+        shutil.copyfileobj(file.file, f, UPLOAD_CHUNK_SIZE)
 
     # Create material record
     material = Material(
@@ -265,84 +339,133 @@ async def upload_material(
     db.add(material)
     db.commit()
 
-    # Start background processing
-    try:
-        # Extract PDF content
-        material.processing_status = 'extracting'
-        db.commit()
+    # Extract concepts and questions after the response is sent; the client
+    # polls /api/materials/{id}/status until the material is ready
+    background_tasks.add_task(process_material, material_id, file_path)
 
-        print(f"Extracting PDF from: {file_path}")
-        pdf_data = pdf_processor.extract(file_path)
-        material.total_pages = pdf_data['total_pages']
-        material.estimated_time_minutes = pdf_data['estimated_time_minutes']
-        print(f"PDF extracted: {material.total_pages} pages, method: {pdf_data.get('extraction_method')}, quality: {pdf_data.get('text_quality')}")
-
-        # Check text quality - reject if we can't read the PDF properly
-        if pdf_data.get('text_quality') == 'poor':
-            raise HTTPException(
-                status_code=400,
-                detail="Could not extract readable text from this PDF. This may be because:\n"
-                       "1. The PDF uses custom fonts that can't be decoded\n"
-                       "2. The PDF is an image/scan with poor quality\n"
-                       "3. The PDF is encrypted or protected\n\n"
-                       "Try uploading a different PDF or a text-based document."
-            )
+    return {
+        "material_id": str(material_id),
+        "user_id": user_id,
+        "filename": file.filename,
+        "status": "uploaded"
+    }
 
-        # Extract concepts
-        material.processing_status = 'extracting_concepts'
-        db.commit()
 
-        print(f"Extracting concepts...")
-        concepts = await concept_extractor.extract_concepts(pdf_data, material.id, db)
-        print(f"Extracted {len(concepts)} concepts")
+def process_material(material_id: uuid.UUID, file_path: str):
+    """
+    Run the PDF -> concepts -> questions pipeline for an uploaded material
 
-        # Generate questions
-        material.processing_status = 'generating_questions'
-        db.commit()
+    A plain function, so BackgroundTasks runs it in the threadpool; the
+    extractor's coroutines are sent back to the event loop, where its OpenAI
+    and Redis clients live.
+    """
+    # Runs after the upload request has finished, so it needs its own session
+    db = SessionLocal()
+    material = db.query(Material).filter(Material.id == material_id).first()
 
-        print(f"Generating questions...")
-        await concept_extractor.generate_questions(concepts, db)
-        print(f"Questions generated successfully")
+    # Material is committed after every status change; keep its loaded
+    # attributes instead of re-SELECTing them after each commit
+    with no_expire_on_commit(db):
+        try:
+            # Extract PDF content
+            material.processing_status = 'extracting'
+            db.commit()
 
-        material.processing_status = 'ready'
-        db.commit()
+            print(f"Extracting PDF from: {file_path}")
+            pdf_data = pdf_processor.extract(file_path)
+            material.total_pages = pdf_data['total_pages']
+            material.estimated_time_minutes = pdf_data['estimated_time_minutes']
+            print(f"PDF extracted: {material.total_pages} pages, method: {pdf_data.get('extraction_method')}, quality: {pdf_data.get('text_quality')}")
+
+            # Check text quality - reject if we can't read the PDF properly
+            if pdf_data.get('text_quality') == 'poor':
+                material.processing_status = 'error'
+                material.error_message = (
+                    "Could not extract readable text from this PDF. This may be because:\n"
+                    "1. The PDF uses custom fonts that can't be decoded\n"
+                    "2. The PDF is an image/scan with poor quality\n"
+                    "3. The PDF is encrypted or protected\n\n"
+                    "Try uploading a different PDF or a text-based document."
+                )
+                db.commit()
+                return
 
-    except HTTPException:
-        # Re-raise HTTP exceptions (like our quality check) as-is
-        raise
-    except Exception as e:
-        print(f"ERROR during processing: {str(e)}")
-        print(f"Error type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
+            # Extract concepts
+            material.processing_status = 'extracting_concepts'
+            db.commit()
 
-        material.processing_status = 'error'
-        material.error_message = str(e)
-        db.commit()
-        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+            print(f"Extracting concepts...")
+            # AI extraction is opt-in like AI questions; fall back to the text
+            # patterns if it found nothing
+            concepts = []
+            if AI_CONCEPTS and concept_extractor.client is not None:
+                concepts = anyio.from_thread.run(concept_extractor.extract_concepts_with_ai, pdf_data, material.id, db)
+            if not concepts:
+                concepts = anyio.from_thread.run(concept_extractor.extract_concepts, pdf_data, material.id, db)
+            print(f"Extracted {len(concepts)} concepts")
+
+            # Generate questions
+            material.processing_status = 'generating_questions'
+            db.commit()
 
-    return {
-        "material_id": str(material_id),
-        "user_id": user_id,
-        "filename": file.filename,
-        "status": "ready",
-        "total_pages": material.total_pages,
-        "estimated_time_minutes": material.estimated_time_minutes,
-        "total_concepts": len(concepts)
-    }
+            print(f"Generating questions...")
+            # AI-written questions are opt-in (they cost an API call per concept);
+            # fall back to the templates if none could be generated
+            generated = 0
+            if AI_QUESTIONS and concept_extractor.client is not None:
+                generated = anyio.from_thread.run(concept_extractor.generate_questions_with_ai, concepts, db)
+            if not generated:
+                anyio.from_thread.run(concept_extractor.generate_questions, concepts, db)
+            print(f"Questions generated successfully")
+
+            material.processing_status = 'ready'
+            db.commit()
+
+        except Exception as e:
+            print(f"ERROR during processing: {str(e)}")
+            print(f"Error type: {type(e).__name__}")
+            import traceback
+            traceback.print_exc()
+
+            db.rollback()
+            material.processing_status = 'error'
+            material.error_message = f"Processing failed: {str(e)}"
+            db.commit()
+
+        finally:
+            db.close()
 
 
 @app.get("/api/materials/{material_id}/status")
-async def get_material_status(material_id: str, db: Session = Depends(get_db)):
+def get_material_status(
+    material_id: str,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db)
+):
     """Check material processing status"""
-    material = db.query(Material).filter(Material.id == uuid.UUID(material_id)).first()
+    # Fetch the material and its concept count in one round trip (clients poll this)
+    concept_count_subquery = (
+        select(func.count(Concept.id))
+        .where(Concept.material_id == Material.id)
+        .scalar_subquery()
+    )
+    row = db.query(Material, concept_count_subquery).filter(
+        Material.id == uuid.UUID(material_id)
+    ).first()
 
-    if not material:
+    if not row:
         raise HTTPException(status_code=404, detail="Material not found")
 
-    # Count concepts
-    from models import Concept
-    concept_count = db.query(Concept).filter(Concept.material_id == material.id).count()
+    material, concept_count = row
+
+    # Status and concept count change together with everything else returned
+    # here, so an unchanged pair lets a poll get a bodyless 304
+    etag = '"' + hashlib.md5(f"{material.processing_status}:{concept_count}".encode()).hexdigest() + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"  # always revalidate
 
     return {
         "material_id": str(material.id),
@@ -356,7 +479,7 @@ async def get_material_status(material_id: str, db: Session = Depends(get_db)):
 
 
 @app.post("/api/sessions/start/{material_id}")
-async def start_session(
+def start_session(
     material_id: str,
     user_id: str,
     goal: Optional[str] = None,
@@ -384,14 +507,8 @@ async def start_session(
     db.commit()
     db.refresh(session)
 
-    # Initialize engagement engine
-    engine = EngagementEngine(
-        session_id=str(session.id),
-        user_id=str(user.id),
-        material_id=str(material.id),
-        db=db
-    )
-    engagement_engines[str(session.id)] = engine
+    # The engagement engine is built when the WebSocket connects
+    total_concepts = db.query(Concept).filter(Concept.material_id == material.id).count()
 
     # Construct WebSocket URL based on environment
     # Auto-detect Render deployment
@@ -408,7 +525,7 @@ async def start_session(
         "session_id": str(session.id),
         "material_id": str(material.id),
         "filename": material.filename,
-        "total_concepts": engine.total_concepts,
+        "total_concepts": total_concepts,
         "websocket_url": f"{ws_protocol}://{ws_host}/ws/{session.id}"
     }
 
@@ -425,6 +542,7 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     - {"type": "hint"}
 
     Messages to client:
+    - {"type": "turn", "events": [...]} - the messages below produced by one answer or skip
     - {"type": "question", "mode": "RAPID_FIRE", "question": "...", "data": {...}}
     - {"type": "feedback", "correct": true, "explanation": "..."}
     - {"type": "mode_switch", "new_mode": "COLLABORATIVE", "reason": "..."}
@@ -433,120 +551,164 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """
     await websocket.accept()
 
-    engine = engagement_engines.get(session_id)
-    if not engine:
-        await websocket.send_json({
+    # Build the engine from the session row on connect: its state lives in the
+    # database, so any worker can serve the socket and a reconnect resumes it.
+    # The engine and this session only do blocking database work, so every call
+    # into them runs in the threadpool rather than on the event loop.
+    db = SessionLocal()
+    try:
+        session = await run_in_threadpool(db.get, SessionModel, uuid.UUID(session_id))
+    except ValueError:
+        session = None
+
+    if not session:
+        await run_in_threadpool(db.close)
+        await send_json(websocket, {
             "type": "error",
             "message": "Session not found"
         })
         await websocket.close()
         return
 
-    try:
-        # Send first question
-        question_data = await engine.get_next_question()
-        if not question_data:
-            await websocket.send_json({
-                "type": "error",
-                "message": "No concepts found for this material. Please upload a valid PDF with content."
-            })
-            await websocket.close()
-            return
-        await websocket.send_json(question_data)
-
-        # Main interaction loop
-        while True:
-            data = await websocket.receive_json()
-
-            if data["type"] == "answer":
-                # Process answer
-                result = await engine.process_answer(
-                    answer=data.get("answer"),
-                    response_time_ms=data.get("response_time_ms"),
-                    hesitation_ms=data.get("hesitation_ms", 0)
-                )
+    # The engine keeps its concept states, questions and session row loaded for
+    # the whole connection, so this session must not expire them on each commit
+    with no_expire_on_commit(db):
+        engine = await run_in_threadpool(
+            EngagementEngine,
+            session_id=session_id,
+            user_id=str(session.user_id),
+            material_id=str(session.material_id),
+            db=db
+        )
 
-                # Send feedback
-                await websocket.send_json({
-                    "type": "feedback",
-                    "correct": result["correct"],
-                    "explanation": result["explanation"],
-                    "mastered": result.get("mastered", False),
-                    "concept_name": result.get("concept_name")
+        try:
+            # Send first question
+            question_data = await run_in_threadpool(engine.get_next_question)
+            if not question_data:
+                await send_json(websocket, {
+                    "type": "error",
+                    "message": "No concepts found for this material. Please upload a valid PDF with content."
                 })
-
-                # Check for mode switch
-                if result.get("mode_switched"):
-                    await websocket.send_json({
-                        "type": "mode_switch",
-                        "new_mode": result["new_mode"],
-                        "reason": result["switch_reason"]
-                    })
-
-                # Check session completion
-                if result.get("session_complete"):
-                    await websocket.send_json({
-                        "type": "session_complete",
-                        "stats": result["stats"]
-                    })
-                    break
-
-                # Send next question
-                question_data = await engine.get_next_question()
-                if not question_data:
-                    await websocket.send_json({
-                        "type": "error",
-                        "message": "No more questions available. Please upload a longer document."
-                    })
+                await websocket.close()
+                return
+            await send_json(websocket, question_data)
+
+            # Main interaction loop
+            while True:
+                try:
+                    raw_message = await asyncio.wait_for(websocket.receive_text(), timeout=WS_IDLE_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Uvicorn's pings only catch dead peers; close live but abandoned
+                    # tabs too, so their session is saved and the connection freed
+                    print(f"WebSocket idle, closing: {session_id}")
                     await websocket.close()
                     break
-                await websocket.send_json(question_data)
 
-            elif data["type"] == "skip":
-                result = await engine.process_skip()
-                await websocket.send_json(result)
-
-                question_data = await engine.get_next_question()
-                if not question_data:
-                    await websocket.send_json({
+                try:
+                    message = client_message.validate_json(raw_message)
+                except ValidationError as e:
+                    await send_json(websocket, {
                         "type": "error",
-                        "message": "No more questions available."
+                        "message": f"Invalid message: {e.errors()[0]['msg']}"
                     })
-                    await websocket.close()
-                    break
-                await websocket.send_json(question_data)
-
-            elif data["type"] == "peek":
-                result = await engine.process_peek()
-                await websocket.send_json(result)
-
-            elif data["type"] == "hint":
-                result = await engine.get_hint()
-                await websocket.send_json(result)
-
-    except WebSocketDisconnect:
-        print(f"WebSocket disconnected: {session_id}")
-        # Save session state
-        if engine:
-            await engine.save_session_state()
-    except Exception as e:
-        print(f"WebSocket error for session {session_id}: {str(e)}")
-        try:
-            await websocket.send_json({
-                "type": "error",
-                "message": f"Server error: {str(e)}"
-            })
-            await websocket.close()
-        except:
-            pass
+                    continue
+
+                if message.type == "answer":
+                    # Process answer
+                    result = await run_in_threadpool(
+                        engine.process_answer,
+                        answer=message.answer,
+                        response_time_ms=message.response_time_ms,
+                        hesitation_ms=message.hesitation_ms
+                    )
+
+                    # Everything this answer produces goes out in one "turn" frame
+                    events = [{
+                        "type": "feedback",
+                        "correct": result["correct"],
+                        "explanation": result["explanation"],
+                        "mastered": result.get("mastered", False),
+                        "concept_name": result.get("concept_name")
+                    }]
+
+                    # Check for mode switch
+                    if result.get("mode_switched"):
+                        events.append({
+                            "type": "mode_switch",
+                            "new_mode": result["new_mode"],
+                            "reason": result["switch_reason"]
+                        })
+
+                    # Check session completion
+                    if result.get("session_complete"):
+                        events.append({
+                            "type": "session_complete",
+                            "stats": result["stats"]
+                        })
+                        await send_json(websocket, {"type": "turn", "events": events})
+                        break
+
+                    # Send next question
+                    question_data = await run_in_threadpool(engine.get_next_question)
+                    if not question_data:
+                        events.append({
+                            "type": "error",
+                            "message": "No more questions available. Please upload a longer document."
+                        })
+                        await send_json(websocket, {"type": "turn", "events": events})
+                        await websocket.close()
+                        break
+                    events.append(question_data)
+                    await send_json(websocket, {"type": "turn", "events": events})
+
+                elif message.type == "skip":
+                    events = [await run_in_threadpool(engine.process_skip)]
+
+                    question_data = await run_in_threadpool(engine.get_next_question)
+                    if not question_data:
+                        events.append({
+                            "type": "error",
+                            "message": "No more questions available."
+                        })
+                        await send_json(websocket, {"type": "turn", "events": events})
+                        await websocket.close()
+                        break
+                    events.append(question_data)
+                    await send_json(websocket, {"type": "turn", "events": events})
+
+                elif message.type == "peek":
+                    result = await run_in_threadpool(engine.process_peek)
+                    await send_json(websocket, result)
+
+                elif message.type == "hint":
+                    result = await run_in_threadpool(engine.get_hint)
+                    await send_json(websocket, result)
+
+        except WebSocketDisconnect:
+            print(f"WebSocket disconnected: {session_id}")
+        except Exception as e:
+            print(f"WebSocket error for session {session_id}: {str(e)}")
+            try:
+                await send_json(websocket, {
+                    "type": "error",
+                    "message": f"Server error: {str(e)}"
+                })
+                await websocket.close()
+            except:
+                pass
 
-    finally:
-        if session_id in engagement_engines:
-            del engagement_engines[session_id]
+        finally:
+            # However the loop ended (disconnect, error, session complete), write the
+            # engine's buffered responses and session end time before dropping it
+            try:
+                await run_in_threadpool(engine.save_session_state)
+            except Exception as save_error:
+                print(f"Could not save session {session_id}: {save_error}")
+            await run_in_threadpool(db.close)
 
 
 @app.get("/api/sessions/{session_id}/stats")
-async def get_session_stats(session_id: str, db: Session = Depends(get_db)):
+def get_session_stats(session_id: str, db: Session = Depends(get_db)):
     """Get session statistics"""
     session = db.query(SessionModel).filter(SessionModel.id == uuid.UUID(session_id)).first()
 
@@ -565,30 +727,31 @@ async def get_session_stats(session_id: str, db: Session = Depends(get_db)):
 
 
 @app.get("/api/users/{user_id}/progress")
-async def get_user_progress(user_id: str, db: Session = Depends(get_db)):
+def get_user_progress(user_id: str, db: Session = Depends(get_db)):
     """Get user overall progress"""
-    from models import UserConceptState
-
     user = db.query(User).filter(User.id == uuid.UUID(user_id)).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Get all concept states
-    states = db.query(UserConceptState).filter(UserConceptState.user_id == user.id).all()
-
-    mastered = [s for s in states if s.state == 'mastered']
-    learning = [s for s in states if s.state == 'learning']
-    struggling = [s for s in states if s.state == 'struggling']
+    # Count concept states in the database rather than loading every row
+    counts = dict(
+        db.query(UserConceptState.state, func.count())
+        .filter(UserConceptState.user_id == user.id)
+        .group_by(UserConceptState.state)
+        .all()
+    )
+    total = sum(counts.values())
+    mastered = counts.get('mastered', 0)
 
     return {
         "user_id": str(user.id),
         "email": user.email,
-        "total_concepts": len(states),
-        "mastered": len(mastered),
-        "learning": len(learning),
-        "struggling": len(struggling),
+        "total_concepts": total,
+        "mastered": mastered,
+        "learning": counts.get('learning', 0),
+        "struggling": counts.get('struggling', 0),
         "total_session_time_minutes": user.total_session_time_minutes,
-        "mastery_rate": len(mastered) / len(states) if states else 0
+        "mastery_rate": mastered / total if total else 0
     }
 
 
@@ -597,7 +760,7 @@ async def get_user_progress(user_id: str, db: Session = Depends(get_db)):
 # ============================================================================
 
 @app.post("/api/inversion/process/{material_id}")
-async def process_inversion(
+def process_inversion(
     material_id: str,
     user_id: str,
     db: Session = Depends(get_db)
@@ -668,7 +831,7 @@ async def process_inversion(
 
 
 @app.get("/api/inversion/{material_id}/paragraphs")
-async def get_inversions(
+def get_inversions(
     material_id: str,
     user_id: str,
     db: Session = Depends(get_db)
@@ -704,7 +867,7 @@ class GapIdentifyRequest(BaseModel):
 
 
 @app.post("/api/inversion/identify-gaps")
-async def identify_gaps(
+def identify_gaps(
     request: GapIdentifyRequest,
     db: Session = Depends(get_db)
 ):
@@ -767,7 +930,7 @@ class PatchCreateRequest(BaseModel):
 
 
 @app.post("/api/inversion/create-patch")
-async def create_patch(
+def create_patch(
     request: PatchCreateRequest,
     user_id: str,
     db: Session = Depends(get_db)
@@ -843,7 +1006,7 @@ async def create_patch(
 
 
 @app.get("/api/inversion/{inversion_id}/gaps")
-async def get_gaps(inversion_id: str, db: Session = Depends(get_db)):
+def get_gaps(inversion_id: str, db: Session = Depends(get_db)):
     """Get all gaps for a specific inversion paragraph"""
     gaps = db.query(Gap).filter(
         Gap.inversion_paragraph_id == uuid.UUID(inversion_id)
@@ -865,7 +1028,7 @@ async def get_gaps(inversion_id: str, db: Session = Depends(get_db)):
 
 
 @app.get("/api/inversion/{inversion_id}/patches")
-async def get_patches(inversion_id: str, db: Session = Depends(get_db)):
+def get_patches(inversion_id: str, db: Session = Depends(get_db)):
     """Get all patches for a specific inversion paragraph"""
     patches = db.query(Patch).filter(
         Patch.inversion_paragraph_id == uuid.UUID(inversion_id)
@@ -901,7 +1064,7 @@ class SocraticHelpRequest(BaseModel):
 
 
 @app.post("/api/inversion/get-help")
-async def get_socratic_help(
+def get_socratic_help(
     request: SocraticHelpRequest,
     db: Session = Depends(get_db)
 ):
@@ -950,4 +1113,13 @@ async def get_socratic_help(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Engines are built per WebSocket connection, so any number of workers can
+    # share sessions
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    )
@@ -21,11 +21,18 @@ def migrate():
     print("Creating tables...")
     Base.metadata.create_all(bind=engine)
 
+    # create_all skips tables that already exist, including their indexes
+    print("Creating missing indexes...")
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
     print("✓ Migration complete!")
     print("\nNew tables created:")
     print("  - inversion_paragraphs")
     print("  - gaps")
     print("  - patches")
+    print("\nIndexes added where missing, e.g. idx_user_concept_states_user_concept")
     print("\nYour database is now ready for Dialectical Learning Mode!")
 
 if __name__ == "__main__":
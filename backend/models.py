@@ -1,7 +1,7 @@
 """
 Database models for Mastery Machine
 """
-from sqlalchemy import Column, String, Integer, Float, Boolean, Text, ForeignKey, TIMESTAMP, JSON
+from sqlalchemy import Column, String, Integer, Float, Boolean, Text, ForeignKey, TIMESTAMP, JSON, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -46,6 +46,9 @@ class Material(Base):
 
 class Concept(Base):
     __tablename__ = 'concepts'
+    __table_args__ = (
+        Index('idx_concepts_material', 'material_id'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     material_id = Column(UUID(as_uuid=True), ForeignKey('materials.id', ondelete='CASCADE'))
@@ -70,6 +73,10 @@ class Concept(Base):
 
 class Question(Base):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Engine loads a material's questions by concept and picks them by (concept, mode)
+        Index('idx_questions_concept_mode', 'concept_id', 'mode'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     concept_id = Column(UUID(as_uuid=True), ForeignKey('concepts.id', ondelete='CASCADE'))
@@ -86,6 +93,12 @@ class Question(Base):
 
 class UserConceptState(Base):
     __tablename__ = 'user_concept_states'
+    __table_args__ = (
+        # Engine loads all of a user's states for a material in one query, and
+        # looks up single (user, concept) states; user_id leads, so this covers both.
+        # Not unique: tables built by create_all had no constraint and may hold duplicates
+        Index('idx_user_concept_states_user_concept', 'user_id', 'concept_id'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'))
@@ -135,6 +148,11 @@ class UserConceptState(Base):
 
 class Response(Base):
     __tablename__ = 'responses'
+    __table_args__ = (
+        # Covers the engine's correct-answer history lookup for predicted recall
+        Index('idx_responses_user_concept_correct', 'user_id', 'concept_id', 'is_correct', 'created_at'),
+        Index('idx_responses_session', 'session_id'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'))
@@ -3,8 +3,8 @@ Paragraph Inversion Module
 Creates logical opposites of paragraphs while maintaining the same structure and wording.
 """
 
-import openai
 import os
+from openai import OpenAI
 from typing import Dict, List, Tuple
 import re
 
@@ -17,8 +17,7 @@ class ParagraphInverter:
 
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
-        if self.api_key:
-            openai.api_key = self.api_key
+        self.client = OpenAI(api_key=self.api_key, max_retries=2, timeout=60) if self.api_key else None
 
     def invert_paragraph(self, original: str) -> str:
         """
@@ -34,7 +33,7 @@ class ParagraphInverter:
             return self._fallback_inversion(original)
 
         try:
-            response = openai.ChatCompletion.create(
+            response = self.client.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {
@@ -151,7 +150,7 @@ Be precise. Every claim should become its opposite."""
             return self._fallback_gap_detection(original, inverted)
 
         try:
-            response = openai.ChatCompletion.create(
+            response = self.client.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {
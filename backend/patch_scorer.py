@@ -3,8 +3,8 @@ Patch Quality Scoring System
 Evaluates user-created patches to ensure deep understanding
 """
 
-import openai
 import os
+from openai import OpenAI
 from typing import Dict, List
 import json
 
@@ -17,8 +17,7 @@ class PatchScorer:
 
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
-        if self.api_key:
-            openai.api_key = self.api_key
+        self.client = OpenAI(api_key=self.api_key, max_retries=2, timeout=60) if self.api_key else None
 
         # Minimum score to consider mastery
         self.mastery_threshold = 7.0
@@ -60,7 +59,7 @@ class PatchScorer:
                 for gap in gaps
             ])
 
-            response = openai.ChatCompletion.create(
+            response = self.client.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {
@@ -235,7 +234,7 @@ Evaluate this patch and return JSON with score and feedback."""
                 for gap in gaps
             ])
 
-            response = openai.ChatCompletion.create(
+            response = self.client.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {
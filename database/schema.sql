@@ -148,11 +148,12 @@ CREATE TABLE IF NOT EXISTS sessions (
 
 -- Indexes for performance
 CREATE INDEX IF NOT EXISTS idx_concepts_material ON concepts(material_id);
-CREATE INDEX IF NOT EXISTS idx_questions_concept ON questions(concept_id);
-CREATE INDEX IF NOT EXISTS idx_user_concept_states_user ON user_concept_states(user_id);
+CREATE INDEX IF NOT EXISTS idx_questions_concept_mode ON questions(concept_id, mode);
+CREATE INDEX IF NOT EXISTS idx_user_concept_states_user_concept ON user_concept_states(user_id, concept_id);
 CREATE INDEX IF NOT EXISTS idx_user_concept_states_concept ON user_concept_states(concept_id);
 CREATE INDEX IF NOT EXISTS idx_responses_user ON responses(user_id);
 CREATE INDEX IF NOT EXISTS idx_responses_session ON responses(session_id);
+CREATE INDEX IF NOT EXISTS idx_responses_user_concept_correct ON responses(user_id, concept_id, is_correct, created_at);
 CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id);
 
 -- Function to update updated_at timestamp
@@ -63,7 +63,13 @@ interface ErrorMessage {
   message: string
 }
 
-type Message = Question | Feedback | ModeSwitch | SessionComplete | Hint | Peek | SkipRecorded | ErrorMessage
+// Everything produced by one answer or skip, in order
+interface Turn {
+  type: 'turn'
+  events: Message[]
+}
+
+type Message = Question | Feedback | ModeSwitch | SessionComplete | Hint | Peek | SkipRecorded | ErrorMessage | Turn
 
 function LearningSession({ sessionId, filename, totalConcepts, onComplete }: LearningSessionProps) {
   const [ws, setWs] = useState<WebSocket | null>(null)
@@ -118,6 +124,10 @@ function LearningSession({ sessionId, filename, totalConcepts, onComplete }: Lea
 
   const handleMessage = (message: Message) => {
     switch (message.type) {
+      case 'turn':
+        message.events.forEach(handleMessage)
+        break
+
       case 'question':
         setCurrentQuestion(message)
         setAnswer('')
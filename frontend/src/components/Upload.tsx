@@ -49,6 +49,36 @@ function Upload({ onUploadComplete }: UploadProps) {
     throw new Error('Max retries exceeded')
   }
 
+  const waitForProcessing = async (materialId: string) => {
+    const statusMessages: Record<string, string> = {
+      uploaded: 'Processing PDF...',
+      extracting: 'Extracting text from PDF...',
+      extracting_concepts: 'Extracting concepts...',
+      generating_questions: 'Generating questions...'
+    }
+
+    while (true) {
+      const statusResponse = await fetchWithRetry(`${API_URL}/api/materials/${materialId}/status`, {
+        method: 'GET'
+      })
+
+      if (!statusResponse.ok) {
+        throw new Error('Failed to check processing status')
+      }
+
+      const statusData = await statusResponse.json()
+      if (statusData.status === 'ready') {
+        return statusData
+      }
+      if (statusData.status === 'error') {
+        throw new Error(statusData.error_message || 'Processing failed')
+      }
+
+      setProgress(statusMessages[statusData.status] || 'Processing PDF...')
+      await new Promise(resolve => setTimeout(resolve, 2000))
+    }
+  }
+
   const handleUpload = async () => {
     if (!email || !file) {
       alert('Please enter email and select a file')
@@ -101,13 +131,16 @@ function Upload({ onUploadComplete }: UploadProps) {
       const uploadData = await uploadResponse.json()
       console.log('Upload successful:', uploadData)
 
+      // Processing runs in the background; poll until it finishes
+      const statusData = await waitForProcessing(uploadData.material_id)
+
       setProgress('Processing complete!')
 
       // Call completion callback
       onUploadComplete(
         uploadData.material_id,
         uploadData.filename,
-        uploadData.total_concepts,
+        statusData.total_concepts,
         uploadData.user_id || userId
       )
 
@@ -2,7 +2,7 @@
 
 # Test script to verify the API is working correctly
 
-API_URL="https://mastery-machine-backend.onrender.com"
+API_URL="${API_URL:-https://mastery-machine-backend.onrender.com}"
 
 echo "================================"
 echo "TESTING MASTERY MACHINE API"
@@ -36,6 +36,19 @@ else
 fi
 echo ""
 
+# Test 3: Create demo material
+echo "3. Testing demo material creation..."
+DEMO_RESPONSE=$(curl -s -X POST $API_URL/api/demo/create)
+echo "Response: $DEMO_RESPONSE"
+DEMO_MATERIAL_ID=$(echo "$DEMO_RESPONSE" | grep -o '"material_id":"[^"]*"' | cut -d'"' -f4)
+if [ -n "$DEMO_MATERIAL_ID" ] && echo "$DEMO_RESPONSE" | grep -q '"total_concepts":3'; then
+    echo "✅ Demo material created: $DEMO_MATERIAL_ID"
+else
+    echo "❌ Demo material creation failed"
+    exit 1
+fi
+echo ""
+
 echo "================================"
 echo "✅ ALL TESTS PASSED"
 echo "================================"